@@ -1,57 +1,512 @@
-import os, json
+import os, json, time, asyncio, logging
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator
 import httpx
 from fastapi import FastAPI, Request
-from utils_ollama import get_ollama_base, http_client
-
-app = FastAPI()
+from fastapi.responses import JSONResponse, PlainTextResponse
+from cache import ResponseCache, cache_key
+from dispatch import Dispatcher, TTLSet
+import metrics
+from metrics import (OLLAMA_GENERATION_SECONDS, OLLAMA_TOKENS_PER_SECOND, OLLAMA_TTFB_SECONDS,
+                     REPLY_FIRST_TOKEN_SECONDS, UPDATE_SECONDS, WEBHOOK_SECONDS, ollama_trace)
+from slog import log_event
+from memory import ChatMemory
+from router import NoBackendAvailable, Router
+from telegram_sender import TELEGRAM_API_BASE, TELEGRAM_MAX_LEN, TelegramSender, split_at
+from utils_ollama import (close_shared_client, get_ollama_bases, ollama_client, open_shared_client,
+                          parse_bases, probe_tags)
 
 # Token Telegram (Render peut fournir TELEGRAM_BOT_TOKEN ou TELEGRAM_TOKEN)
 TELEGRAM_TOKEN = (os.getenv("TELEGRAM_BOT_TOKEN") or os.getenv("TELEGRAM_TOKEN") or "").strip()
-TELEGRAM_API = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}" if TELEGRAM_TOKEN else ""
+TELEGRAM_API = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_TOKEN}" if TELEGRAM_TOKEN else ""
 MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:3b")
 
+# Streaming : on pousse la réponse dans Telegram au fil des tokens
+STREAM_REPLIES = os.getenv("OLLAMA_STREAM", "1").strip().lower() not in ("0", "false", "no", "off")
+STREAM_IDLE_TIMEOUT = float(os.getenv("OLLAMA_STREAM_IDLE_TIMEOUT", "30"))  # max entre deux chunks
+STREAM_EDIT_INTERVAL = float(os.getenv("TELEGRAM_EDIT_INTERVAL", "1.2"))    # throttle editMessageText
+
+# Envoi Telegram : un client partagé, ~30 msg/s au total et ~1 msg/s par chat
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+
+telegram = TelegramSender(TELEGRAM_TOKEN, global_rate=TELEGRAM_GLOBAL_RATE,
+                          chat_rate=TELEGRAM_CHAT_RATE, chat_burst=TELEGRAM_CHAT_BURST)
+
+# Dispatch : le webhook répond tout de suite, des workers traitent les updates
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "4"))
+DISPATCH_QUEUE_MAX = int(os.getenv("DISPATCH_QUEUE_MAX", "200"))
+DISPATCH_DEDUP_TTL = float(os.getenv("DISPATCH_DEDUP_TTL", "600"))
+DISPATCH_OVERFLOW = os.getenv("DISPATCH_OVERFLOW", "busy").strip().lower()  # "busy" ou "shed"
+DISPATCH_DRAIN_SECONDS = float(os.getenv("DISPATCH_DRAIN_SECONDS", "20"))  # vidage des files à l'arrêt
+DISPATCH_BUSY_NOTICE_SECONDS = float(os.getenv("DISPATCH_BUSY_NOTICE_SECONDS", "60"))  # un avis "occupé" par chat et par fenêtre
+BUSY_TEXT = "⏳ Beaucoup de demandes en ce moment, réessaie dans une minute."
+
+# Routeur multi-bases : sondage /api/tags, moins chargé d'abord, disjoncteur, hedging
+OLLAMA_PROBE_INTERVAL = float(os.getenv("OLLAMA_PROBE_INTERVAL", "30"))
+OLLAMA_BREAKER_FAILURES = int(os.getenv("OLLAMA_BREAKER_FAILURES", "3"))
+OLLAMA_BREAKER_COOLDOWN = float(os.getenv("OLLAMA_BREAKER_COOLDOWN", "30"))
+OLLAMA_HEDGE_DELAY = float(os.getenv("OLLAMA_HEDGE_DELAY", "3"))
+NO_BASE_TEXT = "⚠️ OLLAMA_BASE_URL non configurée. Envoie /set_ollama https://…trycloudflare.com"
+
 # Override dynamique (via /set_ollama)
-BASE_OVERRIDE = None
+BASE_OVERRIDE: list[str] | None = None
 
-def current_base() -> str | None:
-    global BASE_OVERRIDE
+def current_bases() -> list[str]:
     if BASE_OVERRIDE:
         return BASE_OVERRIDE
     try:
-        return get_ollama_base()
+        return get_ollama_bases()
     except Exception:
+        return []
+
+def current_base() -> str | None:
+    bases = current_bases()
+    if not bases:
         return None
+    try:
+        return router.pick(MODEL).base
+    except NoBackendAvailable:
+        return bases[0]
 
-async def chat_ollama(user_text: str) -> str:
-    base = current_base()
-    if not base:
-        return "⚠️ OLLAMA_BASE_URL non configurée. Envoie /set_ollama https://…trycloudflare.com"
+router = Router(current_bases(), probe_interval=OLLAMA_PROBE_INTERVAL, failure_threshold=OLLAMA_BREAKER_FAILURES,
+                cooldown=OLLAMA_BREAKER_COOLDOWN, hedge_delay=OLLAMA_HEDGE_DELAY)
+
+# Mémoire de conversation par chat (LRU + budget de tokens, sauvegarde disque optionnelle)
+MEMORY_MAX_CHATS = int(os.getenv("MEMORY_MAX_CHATS", "500"))
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1500"))
+MEMORY_SNAPSHOT_PATH = (os.getenv("MEMORY_SNAPSHOT_PATH") or "").strip() or None
+MEMORY_SNAPSHOT_SECONDS = float(os.getenv("MEMORY_SNAPSHOT_SECONDS", "60"))
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")  # garde le modèle (et son cache) chargé
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "12"))
+
+# Démarrage à froid : préchargement du modèle puis pings pour qu'il reste en mémoire
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "1").strip().lower() not in ("0", "false", "no", "off")
+OLLAMA_WARMUP_TIMEOUT = float(os.getenv("OLLAMA_WARMUP_TIMEOUT", "120"))  # chargement du modèle en mémoire
+OLLAMA_KEEP_WARM_SECONDS = float(os.getenv("OLLAMA_KEEP_WARM_SECONDS", "240"))
 
-    url = f"{base}/api/chat"
-    payload = {
+memory = ChatMemory(max_chats=MEMORY_MAX_CHATS, token_budget=MEMORY_TOKEN_BUDGET, path=MEMORY_SNAPSHOT_PATH)
+
+# Cache de réponses (clé = modèle + prompt normalisé + contexte) et fusion des requêtes identiques
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "1").strip().lower() not in ("0", "false", "no", "off")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX = int(os.getenv("RESPONSE_CACHE_MAX", "1000"))
+RESPONSE_CACHE_PATH = (os.getenv("RESPONSE_CACHE_PATH") or "").strip() or None
+RESPONSE_CACHE_SNAPSHOT_SECONDS = float(os.getenv("RESPONSE_CACHE_SNAPSHOT_SECONDS", "60"))
+# Attente max d'une réponse identique déjà en cours avant de générer la sienne
+RESPONSE_CACHE_WAIT = float(os.getenv("RESPONSE_CACHE_WAIT", "30"))
+# Commandes dont la réponse ne doit jamais venir du cache (séparées par des virgules)
+RESPONSE_CACHE_SKIP = {c.strip() for c in os.getenv("RESPONSE_CACHE_SKIP", "/nocache").split(",") if c.strip()}
+
+response_cache = ResponseCache(ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX, path=RESPONSE_CACHE_PATH)
+
+def cache_policy(text: str) -> tuple[str, bool]:
+    """Prompt à envoyer et usage du cache selon la commande (/nocache <texte> force un appel frais)."""
+    cmd = text.split(maxsplit=1)[0] if text.startswith("/") else ""
+    use_cache = cmd not in RESPONSE_CACHE_SKIP
+    if cmd == "/nocache":
+        text = text[len(cmd):].strip()
+    return text, use_cache
+
+def _chat_payload(user_text: str, history: list[dict], stream: bool) -> dict:
+    return {
         "model": MODEL,
-        "messages": [{"role": "user", "content": user_text}],
-        "stream": False,
+        "messages": history + [{"role": "user", "content": user_text}],
+        "stream": stream,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
     }
-    async with http_client() as c:
-        print(f"[chat_ollama] POST {url} (model={MODEL})")
-        try:
-            r = await c.post(url, json=payload, headers={"ngrok-skip-browser-warning": "true"})
-            print(f"[chat_ollama] status={r.status_code}")
+
+def _observe_eval(base: str, data: dict) -> None:
+    """Débit de génération d'après les compteurs renvoyés par Ollama en fin de réponse."""
+    count, duration = data.get("eval_count"), data.get("eval_duration")
+    if count and duration:
+        OLLAMA_TOKENS_PER_SECOND.observe(count / (duration / 1e9), backend=base)
+
+def _history(chat_id) -> list[dict]:
+    return memory.messages(chat_id) if chat_id is not None else []
+
+async def chat_ollama(user_text: str, chat_id=None, use_cache: bool = True) -> str:
+    if not router.backends:
+        return NO_BASE_TEXT
+
+    history = _history(chat_id)
+    payload = _chat_payload(user_text, history, stream=False)
+    served_by = None
+
+    async def post(base: str) -> dict:
+        url = f"{base}/api/chat"
+        async with ollama_client() as c:
+            t0 = time.perf_counter()
+            r = await c.post(url, json=payload, headers={"ngrok-skip-browser-warning": "true"},
+                             timeout=OLLAMA_TIMEOUT, extensions={"trace": ollama_trace(base)})
             body = await r.aread()
-            print(f"[chat_ollama] body_snippet={body[:180]!r}")
+            # Sans streaming Ollama n'envoie rien avant la fin : TTFB = génération entière.
+            elapsed = time.perf_counter() - t0
+            OLLAMA_TTFB_SECONDS.observe(elapsed, backend=base, mode="blocking")
+            log_event("ollama_chat", backend=base, model=MODEL, status=r.status_code, seconds=round(elapsed, 3), bytes=len(body))
             r.raise_for_status()
             data = json.loads(body.decode("utf-8"))
+            _observe_eval(base, data)
+            # Pas de premier octet distinct : la durée de génération vient des compteurs d'Ollama.
+            gen_ns = data.get("eval_duration")
+            OLLAMA_GENERATION_SECONDS.observe(gen_ns / 1e9 if gen_ns else elapsed, backend=base)
+            return data
+
+    async def generate() -> str | None:
+        nonlocal served_by
+        try:
+            # Sans streaming le premier octet arrive avec la réponse complète :
+            # doubler la requête doublerait la génération, on se contente du basculement.
+            backend, data = await router.call(post, model=MODEL, hedge=False, prefer=memory.backend(chat_id))
+            router.release(backend)
+        except Exception as e:
+            log_event("chat_ollama_error", logging.WARNING, error=repr(e))
+            return None
+        served_by = backend.base
+        return (
+            data.get("message", {}).get("content")
+            or data.get("response")
+            or ""
+        ).strip()
+
+    if use_cache and RESPONSE_CACHE_ENABLED:
+        reply = await response_cache.fetch(cache_key(MODEL, user_text, history), generate, wait=RESPONSE_CACHE_WAIT)
+    else:
+        reply = await generate()
+    if reply is None:
+        return "Petit souci côté IA, réessaie dans une minute."
+    if reply and chat_id is not None:
+        memory.append(chat_id, user_text, reply, backend=served_by)
+    return reply or "Désolé, je n’ai pas pu générer de réponse."
+
+async def stream_ollama(user_text: str, chat_id=None, use_cache: bool = True) -> AsyncIterator[str]:
+    """Produit les morceaux de réponse du flux NDJSON /api/chat d'Ollama.
+
+    Le timeout borne l'attente entre deux morceaux, pas la durée totale de la
+    génération. La base est choisie par le routeur, et la requête est doublée
+    sur une deuxième base si la première ligne tarde. Une réponse complète est
+    ajoutée à l'historique du chat. Avec `use_cache`, une réponse en cache (ou
+    en cours de génération pour le même prompt) est produite d'un bloc au lieu
+    de rappeler Ollama.
+    """
+    if not router.backends:
+        yield NO_BASE_TEXT
+        return
+
+    history = _history(chat_id)
+    key = cache_key(MODEL, user_text, history) if use_cache and RESPONSE_CACHE_ENABLED else None
+    owner = False
+    if key:
+        hit, owner = await response_cache.claim(key, RESPONSE_CACHE_WAIT)
+        if hit:
+            if chat_id is not None:
+                memory.append(chat_id, user_text, hit)
+            yield hit
+            return
+
+    payload = _chat_payload(user_text, history, stream=True)
+    timeout = httpx.Timeout(STREAM_IDLE_TIMEOUT, connect=12.0)
+
+    async def open_stream(base: str) -> tuple[AsyncExitStack, AsyncIterator[str], str]:
+        url = f"{base}/api/chat"
+        stack = AsyncExitStack()
+        try:
+            c = await stack.enter_async_context(ollama_client(timeout))
+            t0 = time.perf_counter()
+            r = await stack.enter_async_context(
+                c.stream("POST", url, json=payload, headers={"ngrok-skip-browser-warning": "true"},
+                         timeout=timeout, extensions={"trace": ollama_trace(base)}))
+            r.raise_for_status()
+            lines = r.aiter_lines()
+            first = ""
+            while not first.strip():
+                first = await lines.__anext__()
+            OLLAMA_TTFB_SECONDS.observe(time.perf_counter() - t0, backend=base, mode="stream")
+            return stack, lines, first
+        except BaseException:
+            await stack.aclose()
+            raise
+
+    text = None
+    try:
+        backend, (stack, lines, first) = await router.call(
+            open_stream, model=MODEL, discard=lambda opened: opened[0].aclose(), prefer=memory.backend(chat_id))
+        error = None
+        reply = []
+        t_first = time.perf_counter()
+        try:
+            async with stack:
+                line = first
+                while True:
+                    if line.strip():
+                        data = json.loads(line)
+                        if data.get("error"):
+                            raise RuntimeError(data["error"])
+                        piece = data.get("message", {}).get("content") or data.get("response") or ""
+                        if piece:
+                            reply.append(piece)
+                            yield piece
+                        if data.get("done"):
+                            _observe_eval(backend.base, data)
+                            # Lire jusqu'à la fin pour que la connexion retourne au pool.
+                            async for _ in lines:
+                                pass
+                            break
+                    try:
+                        line = await lines.__anext__()
+                    except StopAsyncIteration:
+                        break
+            generation = time.perf_counter() - t_first
+            OLLAMA_GENERATION_SECONDS.observe(generation, backend=backend.base)
+            log_event("ollama_stream", backend=backend.base, model=MODEL, generation_s=round(generation, 3), chunks=len(reply))
+            text = "".join(reply).strip()
+            if text and chat_id is not None:
+                memory.append(chat_id, user_text, text, backend=backend.base)
         except Exception as e:
-            print("[chat_ollama] ERROR:", repr(e))
-            return "Petit souci côté IA, réessaie dans une minute."
+            error = e
+            raise
+        finally:
+            router.release(backend, error)
+    finally:
+        if owner:
+            response_cache.finish(key, text)
+        elif key and text:
+            response_cache.put(key, text)
+
+class _Undeliverable(Exception):
+    """Le premier sendMessage d'une réponse a échoué (bot bloqué, 400, 429 persistant…)."""
+
+async def reply_streaming(chat_id, chunks: AsyncIterator[str], received_at: float | None = None) -> None:
+    """Envoie le premier morceau tout de suite, puis édite le message à cadence limitée.
+
+    Au-delà de 4096 caractères le message courant est figé et la suite part
+    dans un nouveau message. Si Telegram refuse le premier envoi, la réponse
+    est abandonnée (et la génération arrêtée) au lieu d'ouvrir un nouveau
+    message à chaque morceau. Le délai jusqu'au premier texte est compté
+    depuis `received_at` (réception par le webhook, file d'attente comprise).
+    """
+    try:
+        await _reply_streaming(chat_id, chunks, received_at)
+    except _Undeliverable as e:
+        log_event("reply_stream_undeliverable", logging.WARNING, chat_id=chat_id, error=str(e))
+    finally:
+        # Quelle que soit la sortie, le flux Ollama est fermé tout de suite : il
+        # libère sa base, sa place de génération en cache et sa connexion.
+        aclose = getattr(chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+async def _reply_streaming(chat_id, chunks: AsyncIterator[str], received_at: float | None) -> None:
+    t0 = received_at or time.monotonic()
+    sent = ""          # texte actuellement visible dans le message courant
+    buf = ""           # texte du message courant (peut être en avance sur `sent`)
+    message_id = None
+    last_edit = 0.0
+    ttft = None
+
+    async def push(text: str) -> None:
+        nonlocal message_id, sent, last_edit
+        text = text[:TELEGRAM_MAX_LEN]
+        if message_id is None:
+            data = await telegram.call("sendMessage", {"chat_id": chat_id, "text": text})
+            if data.get("ok"):
+                message_id = (data.get("result") or {}).get("message_id")
+            if message_id is None:
+                raise _Undeliverable(data.get("description") or f"error_code={data.get('error_code')}")
+        elif text != sent:
+            await telegram.call("editMessageText", {"chat_id": chat_id, "message_id": message_id, "text": text})
+        sent = text
+        last_edit = time.monotonic()
+
+    try:
+        async for piece in chunks:
+            buf += piece
+            while len(buf) > TELEGRAM_MAX_LEN:
+                cut = split_at(buf)
+                await push(buf[:cut].rstrip())
+                buf = buf[cut:].lstrip()
+                message_id, sent = None, ""
+            if message_id is None and buf.strip():
+                await push(buf)
+                if ttft is None:
+                    ttft = time.monotonic() - t0
+                    REPLY_FIRST_TOKEN_SECONDS.observe(ttft)
+            elif time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+                await push(buf)
+    except _Undeliverable:
+        raise
+    except Exception as e:
+        log_event("reply_stream_error", logging.WARNING, chat_id=chat_id, error=repr(e))
+        if not (buf.strip() or sent):
+            await push("Petit souci côté IA, réessaie dans une minute.")
+            return
+        buf = buf.rstrip() + " …"
+
+    if not buf.strip():
+        if message_id is None:
+            await push("Désolé, je n’ai pas pu générer de réponse.")
+        return
+    await push(buf.strip())
+    log_event("reply_stream", chat_id=chat_id, ttft_s=round(ttft or 0.0, 3), total_s=round(time.monotonic() - t0, 3))
 
-    reply = (
-        data.get("message", {}).get("content")
-        or data.get("response")
-        or ""
-    )
-    return reply.strip() or "Désolé, je n’ai pas pu générer de réponse."
+async def handle_update(upd: dict) -> None:
+    """Traite un update et mesure le délai depuis sa réception par le webhook."""
+    t0 = upd.pop("_received_at", None) or time.monotonic()
+    msg = upd.get("message") or upd.get("edited_message") or {}
+    kind = "command" if (msg.get("text") or "").lstrip().startswith("/") else "chat"
+    try:
+        await _handle_update(upd, t0)
+    finally:
+        UPDATE_SECONDS.observe(time.monotonic() - t0, kind=kind)
+
+async def _handle_update(upd: dict, received_at: float) -> None:
+    msg = upd.get("message") or upd.get("edited_message") or {}
+    chat_id = (msg.get("chat") or {}).get("id")
+    text = (msg.get("text") or "").strip()
+
+    # Commande /set_ollama (autorisé pour tout le monde, plus de restriction admin)
+    # Accepte une ou plusieurs bases : /set_ollama https://a… https://b…
+    if text.startswith("/set_ollama"):
+        parts = text.split(maxsplit=1)
+        if len(parts) == 2:
+            try:
+                urls = parse_bases(parts[1])
+            except ValueError:
+                urls = []
+            # Validation simple (évite les /api et espaces)
+            if urls and all(u.startswith("http") for u in urls):
+                global BASE_OVERRIDE
+                BASE_OVERRIDE = urls
+                router.set_bases(urls)
+                await router.probe_all()
+                if OLLAMA_WARMUP:
+                    t = asyncio.create_task(warm_backends())
+                    _background.add(t)
+                    t.add_done_callback(_background.discard)
+                resp = "✅ Base Ollama mise à jour : " + ", ".join(urls)
+            else:
+                resp = "❌ URL invalide. Exemple: https://xxxxx.trycloudflare.com"
+        else:
+            resp = "Usage: /set_ollama https://xxxxx.trycloudflare.com [https://yyyyy.trycloudflare.com …]"
+        if TELEGRAM_API:
+            await telegram.send_message(chat_id, resp)
+        return
+
+    # /reset : oublie l'historique de ce chat
+    if text.startswith("/reset"):
+        memory.reset(chat_id)
+        if TELEGRAM_API:
+            await telegram.send_message(chat_id, "🧹 Conversation oubliée.")
+        return
+
+    # Message normal => appel Ollama
+    prompt, use_cache = cache_policy(text)
+    if STREAM_REPLIES and TELEGRAM_API:
+        await reply_streaming(chat_id, stream_ollama(prompt or "bonjour", chat_id, use_cache), received_at)
+        return
+    reply_text = await chat_ollama(prompt or "bonjour", chat_id, use_cache)
+    if TELEGRAM_API:
+        await telegram.send_message(chat_id, reply_text)
+        REPLY_FIRST_TOKEN_SECONDS.observe(time.monotonic() - received_at)
+
+async def send_busy(chat_id) -> None:
+    try:
+        await telegram.send_message(chat_id, BUSY_TEXT, coalesce=False)
+    except Exception as e:
+        log_event("busy_reply_error", logging.WARNING, chat_id=chat_id, error=repr(e))
+
+# Démarrage : /health répond dès que le port est ouvert (liveness),
+# "ready" ne passe à True qu'une fois le modèle chargé sur au moins une base.
+STARTUP = {"started_at": time.time(), "ready": False, "phase": "starting", "warm_backends": [], "warmup_s": None}
+
+async def warm_model(base: str) -> None:
+    """Charge MODEL en mémoire sur `base` : /api/chat sans message, avec keep_alive."""
+    async with ollama_client(OLLAMA_WARMUP_TIMEOUT) as c:
+        r = await c.post(f"{base}/api/chat", json={"model": MODEL, "messages": [], "keep_alive": OLLAMA_KEEP_ALIVE},
+                         headers={"ngrok-skip-browser-warning": "true"}, timeout=OLLAMA_WARMUP_TIMEOUT)
+        r.raise_for_status()
+
+async def warm_backends() -> list[str]:
+    """Sonde toutes les bases (/api/tags) puis précharge le modèle sur celles qui répondent."""
+    await router.probe_all()
+    targets = [b.base for b in router.backends.values() if b.healthy]
+    results = await asyncio.gather(*(warm_model(b) for b in targets), return_exceptions=True)
+    warm = []
+    for base, res in zip(targets, results):
+        if isinstance(res, Exception):
+            log_event("warmup_error", logging.WARNING, backend=base, error=repr(res))
+        else:
+            warm.append(base)
+    return warm
+
+async def keep_warm() -> None:
+    """Préchauffage au démarrage, puis pings périodiques pour garder le modèle chargé."""
+    t0 = time.monotonic()
+    STARTUP["phase"] = "warming"
+    while True:
+        try:
+            warm = await warm_backends()
+        except Exception as e:
+            log_event("warmup_error", logging.WARNING, error=repr(e))
+            warm = []
+        if STARTUP["warmup_s"] is None and warm:
+            STARTUP["warmup_s"] = round(time.monotonic() - t0, 2)
+            print(f"[startup] modèle {MODEL} chargé en {STARTUP['warmup_s']}s sur {', '.join(warm)}")
+        STARTUP.update(ready=bool(warm), warm_backends=warm,
+                       phase="ready" if warm else ("no_backend" if not router.backends else "degraded"))
+        # Tant que rien n'est chaud on réessaie vite, ensuite au rythme du keep-alive.
+        await asyncio.sleep(OLLAMA_KEEP_WARM_SECONDS if warm else 10)
+
+busy_notified = TTLSet(DISPATCH_BUSY_NOTICE_SECONDS)
+dispatcher = Dispatcher(handle_update, workers=DISPATCH_WORKERS, maxsize=DISPATCH_QUEUE_MAX, dedup_ttl=DISPATCH_DEDUP_TTL)
+_background: set[asyncio.Task] = set()
+
+metrics.Gauge("dispatch_queue_depth", "Updates en attente de traitement.", lambda: dispatcher.snapshot()["queue_depth"])
+metrics.Gauge("dispatch_workers_busy", "Workers en train de traiter un update.", lambda: dispatcher.snapshot()["busy"])
+metrics.Gauge("ollama_in_flight", "Requêtes Ollama en cours, toutes bases confondues.",
+              lambda: sum(b.in_flight for b in router.backends.values()))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    try:
+        print(f"[memory] {memory.load()} chats restaurés")
+    except Exception as e:
+        print("[memory] load ERROR:", repr(e))
+    try:
+        print(f"[cache] {response_cache.load()} réponses restaurées")
+    except Exception as e:
+        print("[cache] load ERROR:", repr(e))
+    open_shared_client(OLLAMA_TIMEOUT)
+    await telegram.start()
+    router.start()
+    dispatcher.start()
+    if OLLAMA_WARMUP:
+        warm = asyncio.create_task(keep_warm())
+        _background.add(warm)
+        warm.add_done_callback(_background.discard)
+    else:
+        STARTUP.update(ready=True, phase="ready")
+    for store, path, every in ((memory, MEMORY_SNAPSHOT_PATH, MEMORY_SNAPSHOT_SECONDS),
+                               (response_cache, RESPONSE_CACHE_PATH, RESPONSE_CACHE_SNAPSHOT_SECONDS)):
+        if path:
+            snap = asyncio.create_task(store.snapshot_loop(every))
+            _background.add(snap)
+            snap.add_done_callback(_background.discard)
+    yield
+    await dispatcher.stop(drain=DISPATCH_DRAIN_SECONDS)
+    await router.stop()
+    await telegram.stop()
+    for t in list(_background):
+        t.cancel()
+    await close_shared_client()
+    for name, store in (("memory", memory), ("cache", response_cache)):
+        try:
+            store.save()
+        except Exception as e:
+            print(f"[{name}] save ERROR:", repr(e))
+
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/")
 def root():
@@ -59,7 +514,17 @@ def root():
 
 @app.get("/health")
 def health():
-    return {"ok": True}
+    return {"ok": True, "live": True, "ready": STARTUP["ready"], "phase": STARTUP["phase"],
+            "uptime_s": round(time.time() - STARTUP["started_at"], 1)}
+
+@app.get("/health/ready")
+def health_ready():
+    body = {"ok": STARTUP["ready"], "model": MODEL, **STARTUP}
+    return JSONResponse(body, status_code=200 if STARTUP["ready"] else 503)
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @app.get("/env")
 def env():
@@ -67,10 +532,27 @@ def env():
     return {
         "OLLAMA_BASE_URL_env": (os.getenv("OLLAMA_BASE_URL") or "").strip(),
         "BASE_used_now": current_base(),
+        "BASES_pool": current_bases(),
         "TELEGRAM_TOKEN_set": bool(TELEGRAM_TOKEN),
         "TELEGRAM_TOKEN_source": src,
     }
 
+@app.get("/diag/queue")
+def diag_queue():
+    return {"ok": True, "overflow_policy": DISPATCH_OVERFLOW, **dispatcher.snapshot(), "telegram": telegram.snapshot()}
+
+@app.get("/diag/cache")
+def diag_cache():
+    return {"ok": True, "enabled": RESPONSE_CACHE_ENABLED, "skip_commands": sorted(RESPONSE_CACHE_SKIP), **response_cache.snapshot()}
+
+@app.get("/diag/memory")
+def diag_memory():
+    return {"ok": True, **memory.snapshot()}
+
+@app.get("/diag/backends")
+def diag_backends():
+    return {"ok": bool(router.backends), **router.snapshot()}
+
 @app.get("/diag")
 async def diag():
     base = current_base()
@@ -78,23 +560,26 @@ async def diag():
         return {"ok": False, "err": "missing OLLAMA_BASE_URL"}
     test_url = f"{base}/api/tags"
     try:
-        async with http_client() as c:
-            r = await c.get(test_url, headers={"ngrok-skip-browser-warning": "true"})
-            body = await r.aread()
-            return {"ok": True, "status": r.status_code, "snippet": body.decode("utf-8")[:120], "url": test_url}
+        r, body = await probe_tags(base)
+        return {"ok": True, "status": r.status_code, "snippet": body.decode("utf-8")[:120], "url": test_url}
     except Exception as e:
         return {"ok": False, "err": repr(e), "url": test_url}
 
 # Webhook Telegram
 @app.post("/telegram/lyra123")
 async def telegram_webhook(req: Request):
+    with WEBHOOK_SECONDS.time():
+        return await _telegram_webhook(req)
+
+async def _telegram_webhook(req: Request):
+    received_at = time.monotonic()
     upd = await req.json()
     msg = upd.get("message") or upd.get("edited_message") or {}
     chat = msg.get("chat") or {}
     chat_id = chat.get("id")
     text = (msg.get("text") or "").strip()
 
-    print(f"[webhook] chat_id={chat_id} text={text!r}")
+    log_event("webhook", chat_id=chat_id, update_id=upd.get("update_id"), text_len=len(text))
 
     # Pas de token => on ne tente pas l'envoi
     if not chat_id:
@@ -102,30 +587,16 @@ async def telegram_webhook(req: Request):
     if not TELEGRAM_TOKEN:
         return {"ok": True, "note": "TELEGRAM_TOKEN missing"}
 
-    # Commande /set_ollama (autorisé pour tout le monde, plus de restriction admin)
-    if text.startswith("/set_ollama"):
-        parts = text.split(maxsplit=1)
-        if len(parts) == 2:
-            url = parts[1].strip().rstrip("/")
-            # Validation simple (évite les /api et espaces)
-            if url.startswith("http") and "/api" not in url:
-                global BASE_OVERRIDE
-                BASE_OVERRIDE = url
-                resp = f"✅ Base Ollama mise à jour : {url}"
-            else:
-                resp = "❌ URL invalide. Exemple: https://xxxxx.trycloudflare.com"
-        else:
-            resp = "Usage: /set_ollama https://xxxxx.trycloudflare.com"
-        if TELEGRAM_API:
-            async with http_client() as c:
-                tr = await c.post(f"{TELEGRAM_API}/sendMessage", json={"chat_id": chat_id, "text": resp})
-                print(f"[telegram] sendMessage status={tr.status_code}")
-        return {"ok": True}
-
-    # Message normal => appel Ollama
-    reply_text = await chat_ollama(text or "bonjour")
-    if TELEGRAM_API:
-        async with http_client() as c:
-            tr = await c.post(f"{TELEGRAM_API}/sendMessage", json={"chat_id": chat_id, "text": reply_text})
-            print(f"[telegram] sendMessage status={tr.status_code}")
-    return {"ok": True}
+    # On acquitte tout de suite : le traitement se fait dans les workers
+    upd["_received_at"] = received_at
+    status = dispatcher.submit(chat_id, upd)
+    if status == "closing":
+        # Instance en arrêt : un statut non-2xx fait redélivrer l'update par Telegram.
+        return JSONResponse({"ok": False, "dispatch": status}, status_code=503)
+    if status == "rejected":
+        log_event("dispatch_rejected", logging.WARNING, policy=DISPATCH_OVERFLOW, chat_id=chat_id)
+        if DISPATCH_OVERFLOW == "busy" and TELEGRAM_API and busy_notified.add(chat_id):
+            t = asyncio.create_task(send_busy(chat_id))
+            _background.add(t)
+            t.add_done_callback(_background.discard)
+    return {"ok": True, "dispatch": status}
@@ -0,0 +1,137 @@
+"""Benchmark OSINT hors ligne : ahmia.fi est simulé à partir des pages de bench/fixtures.
+
+Compare l'ancien moteur (un mot-clé à la fois, arbre BeautifulSoup complet)
+au nouveau (iter_osint : requêtes parallèles, extraction ciblée), avec le
+limiteur par hôte tel que livré (osint.HOST_RATE) puis sans limiteur.
+
+    python bench/bench_osint.py --keywords 50 --latency 0.25 --out bench_osint.json
+"""
+import argparse, asyncio, glob, json, os, sys, time
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+from bs4 import BeautifulSoup
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import osint  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+def load_pages() -> dict:
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURES, "ahmia_*.html"))):
+        with open(path, encoding="utf-8") as f:
+            pages[os.path.basename(path)[len("ahmia_"):-len(".html")]] = f.read()
+    return pages
+
+def fake_ahmia(pages: dict, latency: float) -> httpx.MockTransport:
+    names = sorted(pages)
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency)
+        q = (parse_qs(urlsplit(str(request.url)).query).get("q") or [""])[0]
+        page = pages.get(q) or pages[names[sum(map(ord, q)) % len(names)]]
+        return httpx.Response(200, text=page, headers={"Content-Type": "text/html; charset=utf-8"})
+    return httpx.MockTransport(handler)
+
+def legacy_extract(page: str, limit: int = 5) -> list:
+    # Extraction d'origine : arbre complet html.parser + soup.select("a")
+    soup = BeautifulSoup(page, "html.parser")
+    items = []
+    for a in soup.select("a")[:50]:
+        href = a.get("href", "")
+        text = " ".join((a.get_text() or "").split())
+        if not href or href.startswith("#"):
+            continue
+        if "ahmia.fi" in href and "/search/" in href:
+            continue
+        items.append({"title": text[:120] or "(sans titre)", "url": href})
+        if len(items) >= limit:
+            break
+    return items
+
+def bench_parsers(pages: dict, rounds: int) -> dict:
+    out = {}
+    for name, fn in (("legacy", legacy_extract), ("bs4", osint._extract_links_bs4), ("fast", osint._extract_links)):
+        t0 = time.perf_counter()
+        for _ in range(rounds):
+            for page in pages.values():
+                fn(page, 5)
+        dt = time.perf_counter() - t0
+        out[name] = {"pages_per_s": round(rounds * len(pages) / dt, 1), "ms_per_page": round(1000 * dt / (rounds * len(pages)), 3)}
+    return out
+
+async def legacy_run(keywords: list, transport: httpx.MockTransport) -> int:
+    found = 0
+    async with httpx.AsyncClient(transport=transport) as client:
+        for kw in keywords:
+            r = await client.get(osint.AHMIA_SEARCH.format(kw), timeout=30)
+            found += len(legacy_extract(r.text, 5))
+    return found
+
+async def engine_run(keywords: list, transport: httpx.MockTransport, concurrency: int,
+                     seen: osint.SeenIndex | None = None, host_rate: float = osint.HOST_RATE) -> tuple[int, float]:
+    found, first = 0, None
+    t0 = time.perf_counter()
+    async with httpx.AsyncClient(transport=transport) as client:
+        async for _, _, results in osint.iter_osint(keywords, client, 5, concurrency, host_rate=host_rate, seen=seen):
+            if first is None:
+                first = time.perf_counter() - t0
+            if not isinstance(results, Exception):
+                found += len(results)
+    return found, first or 0.0
+
+async def run(n_keywords: int = 50, latency: float = 0.25, concurrency: int = 8, rounds: int = 20) -> dict:
+    pages = load_pages()
+    names = sorted(pages)
+    keywords = [names[i % len(names)] if i < len(names) else f"{names[i % len(names)]}{i}" for i in range(n_keywords)]
+    transport = fake_ahmia(pages, latency)
+
+    t0 = time.perf_counter()
+    legacy_found = await legacy_run(keywords, transport)
+    legacy_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    engine_found, ttfr = await engine_run(keywords, transport, concurrency)
+    engine_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    await engine_run(keywords, transport, concurrency, host_rate=0)
+    unthrottled_s = time.perf_counter() - t0
+
+    seen = osint.SeenIndex()
+    await engine_run(keywords, transport, concurrency, seen, host_rate=0)
+    rerun_found, _ = await engine_run(keywords, transport, concurrency, seen, host_rate=0)
+
+    return {
+        "keywords": n_keywords,
+        "latency_s": latency,
+        "concurrency": concurrency,
+        "legacy": {"seconds": round(legacy_s, 3), "kw_per_s": round(n_keywords / legacy_s, 2), "results": legacy_found},
+        "engine": {"host_rate": osint.HOST_RATE, "seconds": round(engine_s, 3), "kw_per_s": round(n_keywords / engine_s, 2),
+                   "results": engine_found, "first_result_s": round(ttfr, 3)},
+        "engine_unthrottled": {"seconds": round(unthrottled_s, 3), "kw_per_s": round(n_keywords / unthrottled_s, 2)},
+        "speedup": round(legacy_s / engine_s, 2),
+        "speedup_unthrottled": round(legacy_s / unthrottled_s, 2),
+        "rerun_new_results": rerun_found,
+        "extract": bench_parsers(pages, rounds),
+    }
+
+async def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--keywords", type=int, default=50)
+    ap.add_argument("--latency", type=float, default=0.25, help="latence simulée d'ahmia (s)")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--rounds", type=int, default=20, help="passes du micro-benchmark d'extraction")
+    ap.add_argument("--out", help="fichier JSON de résultats")
+    args = ap.parse_args()
+
+    report = await run(args.keywords, args.latency, args.concurrency, args.rounds)
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    asyncio.run(main())
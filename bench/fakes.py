@@ -0,0 +1,126 @@
+"""Doublures locales d'Ollama et de l'API Telegram pour les benchmarks.
+
+Chaque fausse API compte les connexions TCP qu'elle reçoit (un port client
+distinct = une nouvelle connexion), ce qui montre si l'app réutilise ses
+connexions ou en ouvre une par requête.
+"""
+import asyncio, json, socket, time
+from typing import Callable, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+END_MARK = "[fin]"
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class _Connections:
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.ports: set = set()
+        self.requests = 0
+
+    def seen(self, request: Request) -> None:
+        self.requests += 1
+        if request.client:
+            self.ports.add(request.client.port)
+
+    def snapshot(self) -> dict:
+        return {"requests": self.requests, "connections": len(self.ports)}
+
+def fake_ollama(model: str = "llama3.2:3b", prefill: float = 0.3, tokens: int = 60,
+                token_interval: float = 0.02) -> FastAPI:
+    """/api/chat (NDJSON ou bloquant) et /api/tags.
+
+    `prefill` simule le temps avant le premier token, puis `tokens` morceaux
+    arrivent tous les `token_interval` secondes. La réponse finit par END_MARK.
+    """
+    app = FastAPI()
+    app.state.conns = _Connections()
+    app.state.calls = 0
+
+    def words(n: int) -> List[str]:
+        return [f"mot{i} " for i in range(n - 1)] + [END_MARK]
+
+    def done_line(started: float) -> dict:
+        gen_ns = int(max(tokens * token_interval, 1e-3) * 1e9)
+        return {"model": model, "done": True, "eval_count": tokens, "eval_duration": gen_ns,
+                "total_duration": int((time.perf_counter() - started) * 1e9), "message": {"role": "assistant", "content": ""}}
+
+    @app.get("/api/tags")
+    async def tags(request: Request):
+        app.state.conns.seen(request)
+        return {"models": [{"name": model, "model": model}]}
+
+    @app.post("/api/chat")
+    async def chat(request: Request):
+        app.state.conns.seen(request)
+        app.state.calls += 1
+        body = await request.json()
+        started = time.perf_counter()
+        if not body.get("messages"):
+            # Requête de chargement du modèle (keep_alive seul)
+            return {"model": model, "done": True, "message": {"role": "assistant", "content": ""}}
+        if not body.get("stream", True):
+            await asyncio.sleep(prefill + tokens * token_interval)
+            return {**done_line(started), "message": {"role": "assistant", "content": "".join(words(tokens))}}
+
+        async def gen():
+            await asyncio.sleep(prefill)
+            for w in words(tokens):
+                yield json.dumps({"model": model, "done": False, "message": {"role": "assistant", "content": w}}) + "\n"
+                await asyncio.sleep(token_interval)
+            yield json.dumps(done_line(started)) + "\n"
+        return StreamingResponse(gen(), media_type="application/x-ndjson")
+
+    return app
+
+def fake_telegram(on_message: Optional[Callable[[int, str, float], None]] = None, latency: float = 0.02) -> FastAPI:
+    """sendMessage / editMessageText : répond toujours ok et signale chaque texte reçu."""
+    app = FastAPI()
+    app.state.conns = _Connections()
+    app.state.calls: Dict[str, int] = {}
+    counter = iter(range(1, 1 << 62))
+
+    @app.post("/bot{token}/{method}")
+    async def call(token: str, method: str, request: Request):
+        app.state.conns.seen(request)
+        app.state.calls[method] = app.state.calls.get(method, 0) + 1
+        payload = await request.json()
+        await asyncio.sleep(latency)
+        if on_message and "text" in payload:
+            on_message(int(payload.get("chat_id") or 0), payload["text"], time.perf_counter())
+        return {"ok": True, "result": {"message_id": payload.get("message_id") or next(counter),
+                                       "chat": {"id": payload.get("chat_id")}}}
+
+    return app
+
+class Server:
+    """Serveur uvicorn lancé dans la boucle courante."""
+
+    def __init__(self, app: FastAPI, port: Optional[int] = None):
+        self.app = app
+        self.port = port or free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port,
+                                                     log_level="warning", lifespan="off"))
+        self._task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "Server":
+        self._task = asyncio.create_task(self._server.serve())
+        while not self._server.started:
+            if self._task.done():
+                self._task.result()
+            await asyncio.sleep(0.02)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._server.should_exit = True
+        if self._task:
+            await self._task
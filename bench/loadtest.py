@@ -0,0 +1,279 @@
+"""Test de charge hors ligne de app:app, contre de fausses API Ollama et Telegram.
+
+Lance les doublures (bench/fakes.py), démarre `uvicorn app:app` dans un
+sous-processus pointé dessus (OLLAMA_BASE_URL, TELEGRAM_API_BASE), puis envoie
+des updates réalistes sur /telegram/lyra123 à concurrence croissante.
+
+Pour chaque palier : updates/s, latences d'acquittement et de bout en bout
+(webhook → premier texte et réponse complète côté Telegram), mémoire du
+processus, connexions ouvertes vers chaque fausse API.
+
+    python bench/loadtest.py --levels 1,4,16,64 --requests 200 --out bench/results/main.json
+    python bench/loadtest.py --compare bench/results/main.json      # échoue si régression
+"""
+import argparse, asyncio, json, os, random, subprocess, sys, time
+from typing import Dict, List, Optional
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+from fakes import END_MARK, Server, fake_ollama, fake_telegram, free_port  # noqa: E402
+
+TOKEN = "bench"
+WEBHOOK = "/telegram/lyra123"
+QUESTIONS = [
+    "Quelle est la capitale de l'Australie ?",
+    "Explique-moi la photosynthèse simplement.",
+    "Donne trois idées de repas végétarien.",
+    "Comment fonctionne un moteur diesel ?",
+    "Traduis 'good morning' en espagnol.",
+    "Écris un haïku sur la mer.",
+]
+# (poids, type) : mélange proche du trafic réel du bot
+MIX = [(55, "question"), (20, "greeting"), (8, "empty"), (7, "repeat"), (5, "reset"), (5, "duplicate")]
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return round(values[lo] + (values[hi] - values[lo]) * (k - lo), 4)
+
+def summary(values: List[float]) -> dict:
+    return {"n": len(values), "p50": percentile(values, 50), "p90": percentile(values, 90),
+            "p99": percentile(values, 99), "max": round(max(values), 4) if values else None}
+
+def rss_mb(pid: int) -> Optional[float]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+class Tracker:
+    """Relie chaque texte reçu par le faux Telegram à l'update qui l'a provoqué."""
+
+    def __init__(self) -> None:
+        self.pending: Dict[int, dict] = {}
+
+    def expect(self, chat_id: int, final: Optional[str]) -> dict:
+        entry = {"first": None, "done": None, "final": final, "event": asyncio.Event(), "error": False}
+        self.pending[chat_id] = entry
+        return entry
+
+    def on_message(self, chat_id: int, text: str, at: float) -> None:
+        entry = self.pending.get(chat_id)
+        if entry is None:
+            return
+        if entry["first"] is None:
+            entry["first"] = at
+        if "souci" in text or "Beaucoup de demandes" in text:
+            entry["error"] = True
+        if entry["error"] or entry["final"] is None or entry["final"] in text:
+            entry["done"] = at
+            entry["event"].set()
+
+def make_update(kind: str, update_id: int, chat_id: int) -> dict:
+    text = {
+        "question": random.choice(QUESTIONS) + f" (#{update_id})",
+        "greeting": random.choice(["bonjour", "Bonjour !", "/start", "salut"]),
+        "empty": "",
+        "repeat": random.choice(QUESTIONS),
+        "reset": "/reset",
+    }.get(kind, "bonjour")
+    return {"update_id": update_id, "message": {"message_id": update_id, "chat": {"id": chat_id, "type": "private"},
+                                                "from": {"id": chat_id}, "text": text}}
+
+async def run_level(client: httpx.AsyncClient, app_url: str, tracker: Tracker, concurrency: int,
+                    requests: int, timeout: float, id_base: int) -> dict:
+    kinds = [k for w, k in MIX for _ in range(w)]
+    sem = asyncio.Semaphore(concurrency)
+    ack, first, total = [], [], []
+    outcome = {"ok": 0, "errors": 0, "timeouts": 0, "http_errors": 0}
+
+    async def one(i: int) -> None:
+        kind = random.choice(kinds)
+        update_id = chat_id = id_base + i
+        async with sem:
+            upd = make_update(kind, update_id, chat_id)
+            entry = tracker.expect(chat_id, None if kind == "reset" else END_MARK)
+            t0 = time.perf_counter()
+            try:
+                r = await client.post(f"{app_url}{WEBHOOK}", json=upd)
+                ack.append(time.perf_counter() - t0)
+                if r.status_code != 200:
+                    outcome["http_errors"] += 1
+                    return
+                if kind == "duplicate":
+                    # Redélivrance Telegram : même update_id, ne doit pas générer de 2e réponse.
+                    await client.post(f"{app_url}{WEBHOOK}", json=upd)
+                await asyncio.wait_for(entry["event"].wait(), timeout)
+            except asyncio.TimeoutError:
+                outcome["timeouts"] += 1
+                return
+            except httpx.HTTPError:
+                outcome["http_errors"] += 1
+                return
+            finally:
+                tracker.pending.pop(chat_id, None)
+            outcome["errors" if entry["error"] else "ok"] += 1
+            if entry["first"] is not None:
+                first.append(entry["first"] - t0)
+            total.append(entry["done"] - t0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - t0
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "seconds": round(elapsed, 3),
+        "rps": round(requests / elapsed, 2),
+        **outcome,
+        "ack_s": summary(ack),
+        "first_text_s": summary(first),
+        "total_s": summary(total),
+    }
+
+async def wait_for(client: httpx.AsyncClient, url: str, proc: subprocess.Popen, t0: float, timeout: float = 60.0) -> float:
+    """Secondes écoulées depuis `t0` quand `url` répond 200."""
+    while time.perf_counter() - t0 < timeout:
+        if proc.poll() is not None:
+            raise RuntimeError(f"app:app s'est arrêtée (code {proc.returncode})")
+        try:
+            r = await client.get(url)
+            if r.status_code == 200:
+                return time.perf_counter() - t0
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.05)
+    raise TimeoutError(f"app:app ne répond pas 200 sur {url}")
+
+async def bench(args) -> dict:
+    tracker = Tracker()
+    ollama = fake_ollama(model=args.model, prefill=args.prefill, tokens=args.tokens, token_interval=args.token_interval)
+    telegram = fake_telegram(tracker.on_message, latency=args.telegram_latency)
+    levels = [int(x) for x in args.levels.split(",") if x.strip()]
+
+    async with Server(ollama) as o_srv, Server(telegram) as t_srv:
+        port = free_port()
+        app_url = f"http://127.0.0.1:{port}"
+        env = {
+            **os.environ,
+            "OLLAMA_BASE_URL": o_srv.url,
+            "OLLAMA_MODEL": args.model,
+            "TELEGRAM_API_BASE": t_srv.url,
+            "TELEGRAM_BOT_TOKEN": TOKEN,
+            "LOG_SAMPLE_RATE": "0",
+            **dict(kv.split("=", 1) for kv in args.env),
+        }
+        t_spawn = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1",
+                                 "--port", str(port), "--log-level", "warning"], cwd=ROOT, env=env)
+        try:
+            limits = httpx.Limits(max_connections=max(levels) * 2)
+            async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+                live = await wait_for(client, f"{app_url}/health", proc, t_spawn)
+                ready = await wait_for(client, f"{app_url}/health/ready", proc, t_spawn)
+                report = {
+                    "label": args.label,
+                    "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+                    "startup_live_s": round(live, 3),
+                    "startup_ready_s": round(ready, 3),
+                    "rss_mb_idle": rss_mb(proc.pid),
+                    "levels": [],
+                }
+                for n, c in enumerate(levels):
+                    for srv in (o_srv, t_srv):
+                        srv.app.state.conns.reset()
+                    res = await run_level(client, app_url, tracker, c, args.requests, args.timeout, (n + 1) * 1_000_000)
+                    res["rss_mb"] = rss_mb(proc.pid)
+                    res["connections"] = {"ollama": o_srv.app.state.conns.snapshot(),
+                                          "telegram": t_srv.app.state.conns.snapshot()}
+                    report["levels"].append(res)
+                    print(f"[bench] c={c:<4} rps={res['rps']:<8} total p50={res['total_s']['p50']} "
+                          f"p99={res['total_s']['p99']} ok={res['ok']} err={res['errors']} to={res['timeouts']}")
+                report["ollama_calls"] = o_srv.app.state.calls
+                report["telegram_calls"] = dict(t_srv.app.state.calls)
+                try:
+                    report["metrics_sample"] = (await client.get(f"{app_url}/diag/queue")).json()
+                except Exception:
+                    pass
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    if args.osint:
+        import bench_osint
+        report["osint"] = await bench_osint.run()
+    return report
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Régressions de débit ou de latence au-delà de `tolerance` (fraction), palier par palier."""
+    problems = []
+    base_levels = {lvl["concurrency"]: lvl for lvl in baseline.get("levels", [])}
+    for lvl in report["levels"]:
+        old = base_levels.get(lvl["concurrency"])
+        if not old:
+            continue
+        checks = [("rps", lvl["rps"], old["rps"], False)]
+        for metric in ("first_text_s", "total_s"):
+            for p in ("p50", "p99"):
+                checks.append((f"{metric}.{p}", lvl[metric][p], old[metric][p], True))
+        for name, new, ref, lower_is_better in checks:
+            if not new or not ref:
+                continue
+            change = (new - ref) / ref
+            worse = change > tolerance if lower_is_better else change < -tolerance
+            print(f"  c={lvl['concurrency']:<4} {name:<18} {ref:>10} -> {new:<10} ({change:+.1%}){'  <-- REGRESSION' if worse else ''}")
+            if worse:
+                problems.append(f"c={lvl['concurrency']} {name} {ref} -> {new}")
+    return problems
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--levels", default="1,4,16,64", help="paliers de concurrence")
+    ap.add_argument("--requests", type=int, default=200, help="updates par palier")
+    ap.add_argument("--timeout", type=float, default=60.0, help="attente max d'une réponse (s)")
+    ap.add_argument("--model", default="llama3.2:3b")
+    ap.add_argument("--prefill", type=float, default=0.3, help="faux Ollama : délai avant le premier token")
+    ap.add_argument("--tokens", type=int, default=60, help="faux Ollama : morceaux par réponse")
+    ap.add_argument("--token-interval", type=float, default=0.02)
+    ap.add_argument("--telegram-latency", type=float, default=0.02)
+    ap.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="variable passée à app:app")
+    ap.add_argument("--osint", action="store_true", help="inclure le benchmark OSINT (fixtures ahmia)")
+    ap.add_argument("--label", default="local")
+    ap.add_argument("--out", help="écrit le rapport JSON (ligne de base)")
+    ap.add_argument("--compare", help="rapport JSON de référence")
+    ap.add_argument("--tolerance", type=float, default=0.15, help="écart toléré avant de signaler une régression")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    random.seed(args.seed)
+
+    report = asyncio.run(bench(args))
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"[bench] rapport écrit dans {args.out}")
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            problems = compare(report, json.load(f), args.tolerance)
+        if problems:
+            print("[bench] régressions :", *problems, sep="\n  ")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
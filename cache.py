@@ -0,0 +1,166 @@
+import asyncio, hashlib, json, os, time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+def normalize_prompt(prompt: str) -> str:
+    """Casse, espaces et ponctuation finale ignorés : "Bonjour !" == "bonjour"."""
+    return " ".join(prompt.casefold().split()).rstrip(" !?.…")
+
+def cache_key(model: str, prompt: str, context: Optional[List[dict]] = None) -> str:
+    raw = json.dumps([model, normalize_prompt(prompt), context or []], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """Cache de réponses LLM à TTL et taille bornée, avec fusion des requêtes en vol.
+
+    Tant qu'une réponse est en cours de génération pour une clé, les demandes
+    identiques attendent la même `Future` au lieu de relancer Ollama.
+    """
+
+    def __init__(self, ttl: float = 3600.0, max_entries: int = 1000, path: Optional[str] = None):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.path = path
+        self._items: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()   # clé -> (expiration, réponse)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._dirty = False
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "wait_timeouts": 0, "stored": 0, "evicted": 0, "expired": 0}
+
+    def _lookup(self, key: str) -> Optional[str]:
+        item = self._items.get(key)
+        if item is not None:
+            if item[0] > time.time():
+                self._items.move_to_end(key)
+                return item[1]
+            del self._items[key]
+            self.stats["expired"] += 1
+        return None
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._lookup(key)
+        self.stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    def put(self, key: str, value: str) -> None:
+        self._items[key] = (time.time() + self.ttl, value)
+        self._items.move_to_end(key)
+        self.stats["stored"] += 1
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+            self.stats["evicted"] += 1
+        self._dirty = True
+
+    # --- fusion des requêtes en vol ----------------------------------------
+
+    def pending(self, key: str) -> Optional[asyncio.Future]:
+        """Future de la génération déjà en cours pour `key`, s'il y en a une."""
+        return self._inflight.get(key)
+
+    def begin(self, key: str) -> None:
+        self._inflight[key] = asyncio.get_running_loop().create_future()
+
+    def finish(self, key: str, value: Optional[str]) -> None:
+        """Termine la génération de `key` ; `None` = échec (rien n'est mis en cache)."""
+        fut = self._inflight.pop(key, None)
+        if value:
+            self.put(key, value)
+        if fut is not None and not fut.done():
+            fut.set_result(value)
+
+    async def claim(self, key: str, wait: Optional[float] = None) -> Tuple[Optional[str], bool]:
+        """`(réponse, False)` depuis le cache ou une génération en cours, sinon
+        `(None, owner)` : à l'appelant de générer.
+
+        Avec `owner=True` la génération de `key` lui est réservée et il doit
+        appeler `finish`. Si la génération attendue échoue, un seul des
+        demandeurs en attente la reprend, les autres attendent à nouveau.
+        Après `wait` secondes d'attente l'appelant génère de son côté
+        (`owner=False`) sans toucher à la génération en cours.
+        """
+        # Chaque demande compte une seule fois : hit, fusionnée avec une
+        # génération en cours, ou miss (elle génère elle-même).
+        hit = self._lookup(key)
+        if hit is not None:
+            self.stats["hits"] += 1
+            return hit, False
+        self.stats["coalesced" if key in self._inflight else "misses"] += 1
+        loop = asyncio.get_running_loop()
+        deadline = None if wait is None else loop.time() + wait
+        while True:
+            fut = self.pending(key)
+            if fut is None:
+                self.begin(key)
+                return None, True
+            remaining = None if deadline is None else deadline - loop.time()
+            try:
+                if remaining is not None and remaining <= 0:
+                    raise asyncio.TimeoutError
+                value = await asyncio.wait_for(asyncio.shield(fut), remaining)
+            except asyncio.TimeoutError:
+                self.stats["wait_timeouts"] += 1
+                return None, False
+            if value:
+                return value, False
+
+    async def fetch(self, key: str, compute: Callable[[], Awaitable[Optional[str]]],
+                    wait: Optional[float] = None) -> Optional[str]:
+        """Réponse en cache, sinon celle d'une génération en cours, sinon `compute()`."""
+        hit, owner = await self.claim(key, wait)
+        if hit is not None:
+            return hit
+        value = None
+        try:
+            value = await compute()
+            return value
+        finally:
+            if owner:
+                self.finish(key, value)
+            elif value:
+                self.put(key, value)
+
+    # --- sauvegarde disque ------------------------------------------------
+
+    def save(self) -> bool:
+        if not (self.path and self._dirty):
+            return False
+        now = time.time()
+        items = [[k, exp, v] for k, (exp, v) in self._items.items() if exp > now]
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "items": items}, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        self._dirty = False
+        return True
+
+    def load(self) -> int:
+        if not (self.path and os.path.exists(self.path)):
+            return 0
+        with open(self.path, encoding="utf-8") as f:
+            items = json.load(f).get("items") or []
+        now = time.time()
+        for key, exp, value in items[-self.max_entries:]:
+            if exp > now:
+                self._items[key] = (exp, value)
+        return len(self._items)
+
+    async def snapshot_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.save()
+            except Exception as e:
+                print("[cache] snapshot ERROR:", repr(e))
+
+    def snapshot(self) -> dict:
+        # Une demande fusionnée n'appelle pas Ollama : elle compte comme un hit.
+        served = self.stats["hits"] + self.stats["coalesced"]
+        lookups = served + self.stats["misses"]
+        return {
+            "entries": len(self._items),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "inflight": len(self._inflight),
+            "hit_ratio": round(served / lookups, 3) if lookups else None,
+            "snapshot_path": self.path,
+            **self.stats,
+        }
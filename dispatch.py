@@ -0,0 +1,141 @@
+import asyncio, logging, time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, Hashable
+from slog import log_event
+
+Handler = Callable[[dict], Awaitable[Any]]
+
+class TTLSet:
+    """Petit set à expiration (dédoublonnage des update_id)."""
+
+    def __init__(self, ttl: float = 600.0, maxlen: int = 10000):
+        self.ttl = ttl
+        self.maxlen = maxlen
+        self._items: "OrderedDict[Hashable, float]" = OrderedDict()
+
+    def _purge(self, now: float) -> None:
+        while self._items:
+            key, exp = next(iter(self._items.items()))
+            if exp > now and len(self._items) <= self.maxlen:
+                break
+            self._items.popitem(last=False)
+
+    def add(self, key: Hashable) -> bool:
+        """Ajoute `key`; renvoie False si elle était déjà présente (doublon)."""
+        now = time.monotonic()
+        self._purge(now)
+        if key in self._items:
+            return False
+        self._items[key] = now + self.ttl
+        return True
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+class Dispatcher:
+    """File bornée + pool de workers asyncio.
+
+    Chaque chat a sa propre "lane" (deque) : un seul worker à la fois la traite,
+    donc l'ordre des messages d'un même chat est conservé, tandis que des chats
+    différents avancent en parallèle. Les workers reprennent les lanes à tour
+    de rôle (un update par passage) pour qu'un chat bavard ne monopolise rien.
+    """
+
+    def __init__(self, handler: Handler, workers: int = 4, maxsize: int = 200, dedup_ttl: float = 600.0):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.maxsize = maxsize
+        self._seen = TTLSet(dedup_ttl)
+        self._lanes: Dict[Hashable, deque] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._pending = 0
+        self._busy = 0
+        self._busy_time = 0.0
+        self._started_at = time.monotonic()
+        self._closing = False
+        self._idle: asyncio.Event | None = None
+        self.stats = {"accepted": 0, "processed": 0, "failed": 0, "duplicates": 0, "rejected": 0}
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._started_at = time.monotonic()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self, drain: float = 20.0) -> None:
+        """Refuse les nouveaux updates puis laisse `drain` secondes aux lanes
+        pour se vider : ils ont déjà été acquittés, Telegram ne les renverra pas."""
+        self._closing = True
+        if self._lanes and self._tasks:
+            self._idle = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._idle.wait(), drain)
+            except asyncio.TimeoutError:
+                log_event("dispatch_drain_timeout", logging.WARNING, pending=self._pending, busy=self._busy)
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, chat_id: Hashable, upd: dict) -> str:
+        """Met l'update en file sans attendre : "accepted", "duplicate", "rejected"
+        ou "closing" (arrêt en cours)."""
+        if self._closing:
+            return "closing"
+        update_id = upd.get("update_id")
+        if update_id is not None and not self._seen.add(update_id):
+            self.stats["duplicates"] += 1
+            return "duplicate"
+        if self._pending >= self.maxsize:
+            self.stats["rejected"] += 1
+            return "rejected"
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            # Lane absente = personne ne la détient : on la programme.
+            lane = self._lanes[chat_id] = deque()
+            self._ready.put_nowait(chat_id)
+        lane.append(upd)
+        self._pending += 1
+        self.stats["accepted"] += 1
+        return "accepted"
+
+    async def _worker(self, n: int) -> None:
+        while True:
+            chat_id = await self._ready.get()
+            lane = self._lanes[chat_id]
+            upd = lane.popleft()
+            self._pending -= 1
+            self._busy += 1
+            t0 = time.monotonic()
+            try:
+                await self.handler(upd)
+                self.stats["processed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                log_event("dispatch_error", logging.WARNING, worker=n, chat_id=chat_id, error=repr(e))
+            finally:
+                self._busy -= 1
+                self._busy_time += time.monotonic() - t0
+                if lane:
+                    self._ready.put_nowait(chat_id)
+                else:
+                    del self._lanes[chat_id]
+                    if self._idle is not None and not self._lanes:
+                        self._idle.set()
+
+    def snapshot(self) -> dict:
+        uptime = max(time.monotonic() - self._started_at, 1e-9)
+        busy_time = self._busy_time
+        return {
+            "workers": self.workers,
+            "running": len([t for t in self._tasks if not t.done()]),
+            "busy": self._busy,
+            "utilisation_now": round(self._busy / self.workers, 3),
+            "utilisation_avg": round(min(busy_time / (uptime * self.workers), 1.0), 3),
+            "queue_depth": self._pending,
+            "queue_max": self.maxsize,
+            "chats_pending": len(self._lanes),
+            "dedup_size": len(self._seen),
+            **self.stats,
+        }
@@ -0,0 +1,138 @@
+import asyncio, json, os, sys, time
+from collections import OrderedDict, deque
+from typing import Deque, Hashable, List, Optional, Tuple
+
+Turn = Tuple[str, str]   # (rôle, texte)
+
+# Les rôles sont internés : chaque tour ne coûte que son texte + un tuple.
+USER = sys.intern("user")
+ASSISTANT = sys.intern("assistant")
+
+def estimate_tokens(text: str) -> int:
+    """Approximation grossière (~4 caractères par token), suffisante pour un budget."""
+    return len(text) // 4 + 1
+
+class ChatHistory:
+    __slots__ = ("turns", "tokens", "backend", "touched")
+
+    def __init__(self) -> None:
+        self.turns: Deque[Turn] = deque()
+        self.tokens = 0
+        self.backend: Optional[str] = None   # base Ollama qui a le cache KV de ce chat
+        self.touched = time.time()
+
+    def nbytes(self) -> int:
+        size = sys.getsizeof(self) + sys.getsizeof(self.turns)
+        for turn in self.turns:
+            size += sys.getsizeof(turn) + sys.getsizeof(turn[1])
+        return size
+
+class ChatMemory:
+    """Historique par chat, borné en nombre de chats (LRU) et en tokens par chat.
+
+    Quand un chat dépasse `token_budget`, ses plus anciens tours sont retirés
+    par paires question/réponse. Le contenu peut être sauvegardé sur disque
+    (`path`) pour survivre à un redémarrage.
+    """
+
+    def __init__(self, max_chats: int = 500, token_budget: int = 1500, path: Optional[str] = None):
+        self.max_chats = max(1, max_chats)
+        self.token_budget = token_budget
+        self.path = path
+        self._chats: "OrderedDict[Hashable, ChatHistory]" = OrderedDict()
+        self._dirty = False
+        self.stats = {"evicted_chats": 0, "trimmed_turns": 0}
+
+    def _get(self, chat_id: Hashable, create: bool = False) -> Optional[ChatHistory]:
+        h = self._chats.get(chat_id)
+        if h is not None:
+            self._chats.move_to_end(chat_id)
+        elif create:
+            h = self._chats[chat_id] = ChatHistory()
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+                self.stats["evicted_chats"] += 1
+        return h
+
+    def messages(self, chat_id: Hashable) -> List[dict]:
+        h = self._get(chat_id)
+        if h is None:
+            return []
+        return [{"role": role, "content": text} for role, text in h.turns]
+
+    def backend(self, chat_id: Hashable) -> Optional[str]:
+        h = self._chats.get(chat_id)
+        return h.backend if h else None
+
+    def append(self, chat_id: Hashable, user_text: str, reply: str, backend: Optional[str] = None) -> None:
+        h = self._get(chat_id, create=True)
+        for turn in ((USER, user_text), (ASSISTANT, reply)):
+            h.turns.append(turn)
+            h.tokens += estimate_tokens(turn[1])
+        while h.tokens > self.token_budget and len(h.turns) > 2:
+            for _ in range(2):
+                _, text = h.turns.popleft()
+                h.tokens -= estimate_tokens(text)
+                self.stats["trimmed_turns"] += 1
+        if backend:
+            h.backend = backend
+        h.touched = time.time()
+        self._dirty = True
+
+    def reset(self, chat_id: Hashable) -> None:
+        if self._chats.pop(chat_id, None) is not None:
+            self._dirty = True
+
+    # --- sauvegarde disque ------------------------------------------------
+
+    def save(self) -> bool:
+        if not (self.path and self._dirty):
+            return False
+        data = {
+            str(cid): {"turns": list(h.turns), "backend": h.backend, "touched": h.touched}
+            for cid, h in self._chats.items()
+        }
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "chats": data}, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, self.path)
+        self._dirty = False
+        return True
+
+    def load(self) -> int:
+        if not (self.path and os.path.exists(self.path)):
+            return 0
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f).get("chats") or {}
+        for cid, entry in sorted(data.items(), key=lambda kv: kv[1].get("touched", 0)):
+            try:
+                chat_id: Hashable = int(cid)
+            except ValueError:
+                chat_id = cid
+            h = self._get(chat_id, create=True)
+            for role, text in entry.get("turns") or []:
+                h.turns.append((USER if role == USER else ASSISTANT, text))
+                h.tokens += estimate_tokens(text)
+            h.backend = entry.get("backend")
+            h.touched = entry.get("touched") or h.touched
+        return len(self._chats)
+
+    async def snapshot_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.save()
+            except Exception as e:
+                print("[memory] snapshot ERROR:", repr(e))
+
+    def snapshot(self) -> dict:
+        return {
+            "chats": len(self._chats),
+            "max_chats": self.max_chats,
+            "token_budget": self.token_budget,
+            "turns": sum(len(h.turns) for h in self._chats.values()),
+            "tokens": sum(h.tokens for h in self._chats.values()),
+            "bytes": sum(h.nbytes() for h in self._chats.values()) + sys.getsizeof(self._chats),
+            "snapshot_path": self.path,
+            **self.stats,
+        }
@@ -0,0 +1,141 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+# Secondes : du message Telegram instantané jusqu'à la génération longue.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200)
+
+Labels = Tuple[str, ...]
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, object]) -> Labels:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_fmt(v)}" for k, v in self._values.items()]
+
+class Gauge(_Metric):
+    """Jauge lue au moment du scrape (profondeur de file, etc.)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], float]):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        try:
+            value = float(self.fn())
+        except Exception:
+            return []
+        return self.header() + [f"{self.name} {_fmt(value)}"]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Labels, list] = {}   # labels -> [compteurs par bucket…, somme, total]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        s = self._series.get(key)
+        if s is None:
+            s = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        s[bisect_left(self.buckets, value)] += 1
+        s[-2] += value
+        s[-1] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for key, s in self._series.items():
+            acc = 0
+            for le, n in zip(self.buckets + (float("inf"),), s):
+                acc += n
+                le_label = 'le="%s"' % _fmt(le)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le_label)} {acc}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(s[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {s[-1]}")
+        return lines
+
+REGISTRY: List[_Metric] = []
+
+def render() -> str:
+    """Toutes les métriques au format texte Prometheus (0.0.4)."""
+    lines: List[str] = []
+    for m in REGISTRY:
+        lines += m.render()
+    return "\n".join(lines) + "\n"
+
+# --- métriques de l'application ------------------------------------------
+
+WEBHOOK_SECONDS = Histogram("webhook_seconds", "Durée du handler HTTP du webhook (acquittement).")
+UPDATE_SECONDS = Histogram("update_seconds", "Réception du webhook jusqu'à la réponse envoyée (file comprise).", ["kind"])
+OLLAMA_CONNECT_SECONDS = Histogram("ollama_connect_seconds", "DNS + TCP + TLS vers la base Ollama.", ["backend"])
+OLLAMA_TTFB_SECONDS = Histogram("ollama_ttfb_seconds", "Envoi de la requête jusqu'au premier octet de réponse.", ["backend", "mode"])
+OLLAMA_GENERATION_SECONDS = Histogram("ollama_generation_seconds", "Premier octet jusqu'à la fin de la génération.", ["backend"])
+OLLAMA_TOKENS_PER_SECOND = Histogram("ollama_tokens_per_second", "Débit de génération (eval_count / eval_duration).",
+                                     ["backend"], buckets=RATE_BUCKETS)
+OLLAMA_ERRORS = Counter("ollama_errors_total", "Erreurs d'appel Ollama par base.", ["backend", "kind"])
+REPLY_FIRST_TOKEN_SECONDS = Histogram("reply_first_token_seconds", "Réception du webhook jusqu'au premier texte visible dans Telegram (file comprise).")
+TELEGRAM_SEND_SECONDS = Histogram("telegram_send_seconds", "Latence d'un appel à l'API Telegram.", ["method"])
+TELEGRAM_ERRORS = Counter("telegram_errors_total", "Appels Telegram en échec.", ["method", "kind"])
+
+def ollama_trace(backend: str):
+    """Extension `trace` httpx : mesure la phase DNS/connexion/TLS d'une requête."""
+    started: Dict[str, float] = {}
+
+    async def trace(event: str, info: dict) -> None:
+        if event == "connection.connect_tcp.started":
+            started["t"] = time.perf_counter()
+        elif event in ("connection.start_tls.complete", "connection.connect_tcp.complete") and "t" in started:
+            # Avec TLS on attend la fin de la poignée de main ; sinon la fin du TCP.
+            if event == "connection.start_tls.complete" or not str(backend).startswith("https"):
+                OLLAMA_CONNECT_SECONDS.observe(time.perf_counter() - started.pop("t"), backend=backend)
+    return trace
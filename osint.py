@@ -1,42 +1,166 @@
-from typing import List, Dict, Optional
-from urllib.parse import quote_plus
+import asyncio, html, json, os, re, time
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, quote_plus, urlsplit
 import httpx
-from bs4 import BeautifulSoup
+from ratelimit import TokenBucket
 
-async def _search_ahmia(keyword: str, client: httpx.AsyncClient, limit: int = 5) -> List[Dict]:
-    url = f"https://ahmia.fi/search/?q={quote_plus(keyword)}"
-    r = await client.get(url, timeout=30)
-    r.raise_for_status()
-    soup = BeautifulSoup(r.text, "html.parser")
+AHMIA_SEARCH = "https://ahmia.fi/search/?q={}"
+# Avec un index des résultats déjà vus, on extrait plus large avant de filtrer :
+# sinon un nouveau résultat classé après les premiers ne serait jamais signalé.
+SEEN_CANDIDATES = 50
+# Politesse envers ahmia.fi, réglée pour rester au-dessus du débit de l'ancien
+# moteur séquentiel (une requête à la fois, soit ~1/latence requêtes/s).
+HOST_RATE = 6.0
+HOST_BURST = 8
+
+# Extraction ciblée : on ne regarde que les balises <a …>…</a> au lieu de
+# construire tout l'arbre HTML de la page.
+_A_RE = re.compile(r"<a\b([^>]*)>(.*?)</a\s*>", re.I | re.S)
+_HREF_RE = re.compile(r"""\bhref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.I)
+_TAG_RE = re.compile(r"<[^>]+>")
+
+def _keep(href: str) -> bool:
+    """Ne garde que les vrais résultats : redirections ahmia ou liens externes
+    (la navigation du site et les liens de recherche sont ignorés)."""
+    if "redirect_url=" in href:
+        return True
+    if not href.startswith(("http://", "https://")):
+        return False
+    host = urlsplit(href).hostname or ""
+    return host != "ahmia.fi" and not host.endswith(".ahmia.fi")
+
+def _extract_links(page: str, limit: int = 5) -> List[Dict]:
     items: List[Dict] = []
-    for a in soup.select("a")[:50]:
-        href = a.get("href", "")
-        text = " ".join((a.get_text() or "").split())
-        if not href or href.startswith("#"):
+    for m in _A_RE.finditer(page):
+        h = _HREF_RE.search(m.group(1))
+        href = html.unescape(next((g for g in h.groups() if g is not None), "")) if h else ""
+        if not _keep(href):
             continue
-        if "ahmia.fi" in href and "/search/" in href:
+        text = " ".join(html.unescape(_TAG_RE.sub(" ", m.group(2))).split())
+        items.append({"title": text[:120] or "(sans titre)", "url": href})
+        if len(items) >= limit:
+            break
+    return items
+
+def _extract_links_bs4(page: str, limit: int = 5) -> List[Dict]:
+    """Même extraction via BeautifulSoup (plus tolérante au HTML cassé, plus lente)."""
+    from bs4 import BeautifulSoup, SoupStrainer  # import lourd, seulement si ce parseur est choisi
+    soup = BeautifulSoup(page, "html.parser", parse_only=SoupStrainer("a"))
+    items: List[Dict] = []
+    for a in soup.find_all("a"):
+        href = a.get("href", "")
+        if not _keep(href):
             continue
+        text = " ".join((a.get_text() or "").split())
         items.append({"title": text[:120] or "(sans titre)", "url": href})
         if len(items) >= limit:
             break
     return items
 
-async def run_osint(keywords: List[str], proxies: Optional[str] = None, per_kw_limit: int = 5) -> str:
-    proxy_cfg = proxies if proxies else None
-    async with httpx.AsyncClient(proxies=proxy_cfg, follow_redirects=True, headers={"User-Agent":"Mozilla/5.0"}) as client:
-        out_lines: List[str] = []
-        for kw in keywords:
+EXTRACTORS = {"fast": _extract_links, "bs4": _extract_links_bs4}
+
+def result_key(url: str) -> str:
+    """Identité d'un résultat : la cible réelle des liens de redirection ahmia."""
+    target = parse_qs(urlsplit(url).query).get("redirect_url")
+    return (target[0] if target else url).rstrip("/")
+
+class SeenIndex:
+    """Index persistant des URLs déjà signalées (pour ne rapporter que les nouveautés)."""
+
+    def __init__(self, path: Optional[str] = None, max_items: int = 50000):
+        self.path = path
+        self.max_items = max_items
+        self._seen: Dict[str, float] = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._seen = dict(json.load(f).get("seen") or {})
+
+    def add(self, key: str) -> bool:
+        """True si `key` est nouvelle."""
+        if key in self._seen:
+            return False
+        self._seen[key] = time.time()
+        return True
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        if len(self._seen) > self.max_items:
+            newest = sorted(self._seen.items(), key=lambda kv: kv[1])[-self.max_items:]
+            self._seen = dict(newest)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "seen": self._seen}, f, separators=(",", ":"))
+        os.replace(tmp, self.path)
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+async def _search_ahmia(keyword: str, client: httpx.AsyncClient, limit: int = 5,
+                        bucket: Optional[TokenBucket] = None, parser: str = "fast") -> List[Dict]:
+    if bucket is not None:
+        await bucket.acquire()
+    r = await client.get(AHMIA_SEARCH.format(quote_plus(keyword)), timeout=30)
+    r.raise_for_status()
+    return EXTRACTORS[parser](r.text, limit)
+
+async def iter_osint(keywords: Iterable[str], client: httpx.AsyncClient, per_kw_limit: int = 5,
+                     concurrency: int = 8, host_rate: float = HOST_RATE, host_burst: int = HOST_BURST,
+                     seen: Optional[SeenIndex] = None, parser: str = "fast",
+                     ) -> AsyncIterator[Tuple[int, str, List[Dict] | Exception]]:
+    """Interroge ahmia pour tous les mots-clés en parallèle et produit
+    `(index, mot-clé, résultats | exception)` dès qu'un mot-clé est traité.
+
+    Au plus `concurrency` requêtes en vol, et `host_rate` requêtes/s vers
+    ahmia.fi. Avec `seen`, seuls les résultats jamais vus sont produits (au
+    plus `per_kw_limit`, choisis parmi les SEEN_CANDIDATES premiers liens).
+    """
+    kws = [(i, kw.strip()) for i, kw in enumerate(keywords) if kw.strip()]
+    sem = asyncio.Semaphore(max(1, concurrency))
+    bucket = TokenBucket(host_rate, host_burst)
+    extract_limit = per_kw_limit if seen is None else max(per_kw_limit, SEEN_CANDIDATES)
+
+    async def one(i: int, kw: str) -> Tuple[int, str, List[Dict] | Exception]:
+        async with sem:
             try:
-                kw = kw.strip()
-                if not kw:
-                    continue
-                results = await _search_ahmia(kw, client, limit=per_kw_limit)
-                if not results:
-                    out_lines.append(f"[INFO] {kw}: aucun resultat exploitable.")
-                else:
-                    out_lines.append(f"[INFO] {kw}: {len(results)} resultats")
-                    for i, it in enumerate(results, 1):
-                        out_lines.append(f"  {i}. {it['title']}")
+                return i, kw, await _search_ahmia(kw, client, extract_limit, bucket, parser)
             except Exception as e:
-                out_lines.append(f"[WARN] {kw}: erreur {e!r}")
+                return i, kw, e
+
+    tasks = [asyncio.create_task(one(i, kw)) for i, kw in kws]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            i, kw, results = await fut
+            if seen is not None and not isinstance(results, Exception):
+                fresh: List[Dict] = []
+                for it in results:
+                    if len(fresh) >= per_kw_limit:
+                        break
+                    if seen.add(result_key(it["url"])):
+                        fresh.append(it)
+                results = fresh
+            yield i, kw, results
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def run_osint(keywords: List[str], proxies: Optional[str] = None, per_kw_limit: int = 5,
+                    concurrency: int = 8, host_rate: float = HOST_RATE, seen_path: Optional[str] = None) -> str:
+    proxy_cfg = proxies if proxies else None
+    seen = SeenIndex(seen_path) if seen_path else None
+    async with httpx.AsyncClient(proxies=proxy_cfg, follow_redirects=True, headers={"User-Agent":"Mozilla/5.0"},
+                                 limits=httpx.Limits(max_connections=max(1, concurrency))) as client:
+        blocks: Dict[int, List[str]] = {}
+        async for i, kw, results in iter_osint(keywords, client, per_kw_limit, concurrency, host_rate, seen=seen):
+            if isinstance(results, Exception):
+                blocks[i] = [f"[WARN] {kw}: erreur {results!r}"]
+            elif not results:
+                blocks[i] = [f"[INFO] {kw}: " + ("aucun nouveau resultat." if seen is not None else "aucun resultat exploitable.")]
+            else:
+                blocks[i] = [f"[INFO] {kw}: {len(results)} resultats"]
+                blocks[i] += [f"  {n}. {it['title']}" for n, it in enumerate(results, 1)]
+        if seen is not None:
+            seen.save()
+        out_lines = [line for i in sorted(blocks) for line in blocks[i]]
         return "\n".join(out_lines[:1200]) if out_lines else "Aucun resultat OSINT."
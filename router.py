@@ -0,0 +1,288 @@
+import asyncio, json, logging, time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+import httpx
+
+from metrics import OLLAMA_ERRORS
+from slog import log_event
+from utils_ollama import probe_tags
+
+T = TypeVar("T")
+
+class NoBackendAvailable(RuntimeError):
+    pass
+
+class Backend:
+    """Une base Ollama (GPU maison derrière un tunnel) et son état de santé."""
+
+    def __init__(self, base: str):
+        self.base = base
+        self.healthy: Optional[bool] = None   # None = pas encore sondé
+        self.models: set[str] = set()
+        self.in_flight = 0
+        self.failures = 0                     # échecs consécutifs
+        self.open_until = 0.0                 # disjoncteur ouvert jusqu'à cette date (0 = fermé)
+        self.trial = False                    # requête d'essai en cours (disjoncteur semi-ouvert)
+        self.ttfb: Optional[float] = None     # moyenne glissante du premier octet
+        self.last_probe: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.stats = {"routed": 0, "ok": 0, "errors": 0, "hedged": 0, "hedge_wins": 0, "trips": 0}
+
+    def breaker(self, now: float) -> str:
+        if not self.open_until:
+            return "closed"
+        return "open" if now < self.open_until else "half-open"
+
+    def available(self, now: float) -> bool:
+        # Après le délai de refroidissement le disjoncteur est "semi-ouvert" :
+        # une seule requête d'essai passe, un nouvel échec le rouvre aussitôt.
+        state = self.breaker(now)
+        return state == "closed" or (state == "half-open" and not self.trial)
+
+    def snapshot(self, now: float) -> dict:
+        return {
+            "base": self.base,
+            "healthy": self.healthy,
+            "breaker": self.breaker(now),
+            "in_flight": self.in_flight,
+            "failures": self.failures,
+            "ttfb_avg": round(self.ttfb, 3) if self.ttfb is not None else None,
+            "models": sorted(self.models),
+            "last_probe_age": round(now - self.last_probe, 1) if self.last_probe else None,
+            "last_error": self.last_error,
+            **self.stats,
+        }
+
+class Router:
+    """Répartit les appels Ollama sur un pool de bases.
+
+    Un sondeur en tâche de fond interroge /api/tags sur chaque base (santé +
+    modèles présents). Chaque requête part vers la base saine qui a le moins
+    de requêtes en cours ; si aucune base ne répond au sondage, la meilleure
+    est tentée quand même et seul le disjoncteur peut la bloquer. Après
+    `failure_threshold` échecs d'affilée une base est mise de côté `cooldown`
+    secondes, puis une seule requête d'essai décide de sa réouverture. Si le
+    premier octet tarde plus de `hedge_delay`, une seconde requête part vers
+    une autre base et la première qui répond l'emporte.
+    """
+
+    def __init__(self, bases: Iterable[str] = (), probe_interval: float = 30.0,
+                 failure_threshold: int = 3, cooldown: float = 30.0, hedge_delay: float = 3.0):
+        self.probe_interval = probe_interval
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.hedge_delay = hedge_delay
+        self.backends: Dict[str, Backend] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.set_bases(bases)
+
+    def set_bases(self, bases: Iterable[str]) -> None:
+        """Remplace le pool en gardant l'état des bases déjà connues."""
+        self.backends = {b: self.backends.get(b) or Backend(b) for b in bases}
+
+    # --- sondage -----------------------------------------------------------
+
+    async def probe(self, backend: Backend) -> None:
+        try:
+            r, body = await probe_tags(backend.base)
+            r.raise_for_status()
+            tags = json.loads(body.decode("utf-8") or "{}")
+            backend.models = {m.get("name") or m.get("model") for m in tags.get("models") or []} - {None}
+            backend.healthy = True
+            backend.last_error = None
+        except Exception as e:
+            backend.healthy = False
+            backend.last_error = repr(e)
+        backend.last_probe = time.monotonic()
+
+    async def probe_all(self) -> None:
+        await asyncio.gather(*(self.probe(b) for b in list(self.backends.values())))
+
+    async def _probe_loop(self) -> None:
+        while True:
+            try:
+                await self.probe_all()
+            except Exception as e:
+                log_event("router_probe_error", logging.WARNING, error=repr(e))
+            await asyncio.sleep(self.probe_interval)
+
+    def start(self) -> None:
+        if self._task is None and self.probe_interval > 0:
+            self._task = asyncio.create_task(self._probe_loop())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    # --- routage -----------------------------------------------------------
+
+    def pick(self, model: Optional[str] = None, exclude: Iterable[Backend] = (),
+             prefer: Optional[str] = None) -> Backend:
+        """Base saine la moins chargée. `prefer` (base déjà utilisée par le chat,
+        dont le cache de prompt est chaud) l'emporte tant qu'elle n'a pas plus
+        d'une requête en cours de plus que la meilleure."""
+        now = time.monotonic()
+        excluded = set(id(b) for b in exclude)
+        candidates = [b for b in self.backends.values() if id(b) not in excluded and b.available(now)]
+        if not candidates:
+            raise NoBackendAvailable("aucune base Ollama disponible")
+        # Un sondage raté (tunnel lent) ne suffit pas à refuser le trafic : les
+        # bases qui ne répondent pas au sondage restent le dernier recours.
+        candidates = [b for b in candidates if b.healthy is not False] or candidates
+
+        def rank(b: Backend) -> Tuple:
+            lacks_model = bool(model and b.models and model not in b.models)
+            return (lacks_model, b.healthy is not True, b.in_flight,
+                    b.ttfb if b.ttfb is not None else float("inf"))
+        best = min(candidates, key=rank)
+        sticky = self.backends.get(prefer) if prefer else None
+        if sticky in candidates and rank(sticky)[:2] == rank(best)[:2] and sticky.in_flight <= best.in_flight + 1:
+            return sticky
+        return best
+
+    def _acquire(self, backend: Backend) -> bool:
+        # Synchrone, dès le choix de la base : deux appels simultanés ne
+        # peuvent pas prendre tous les deux l'essai d'une base semi-ouverte.
+        backend.in_flight += 1
+        backend.stats["routed"] += 1
+        trial = backend.breaker(time.monotonic()) == "half-open"
+        if trial:
+            backend.trial = True
+        return trial
+
+    def _abort(self, backend: Backend, trial: bool) -> None:
+        """Tentative annulée avant d'aboutir (requête doublée perdante, appel annulé)."""
+        backend.in_flight -= 1
+        if trial:
+            backend.trial = False
+
+    def _success(self, backend: Backend, ttfb: float) -> None:
+        backend.failures = 0
+        backend.open_until = 0.0
+        backend.trial = False
+        backend.stats["ok"] += 1
+        backend.ttfb = ttfb if backend.ttfb is None else 0.8 * backend.ttfb + 0.2 * ttfb
+
+    def release(self, backend: Backend, error: Optional[BaseException] = None) -> None:
+        """Fin d'utilisation d'une base obtenue par `call` (erreur éventuelle en cours de flux)."""
+        backend.in_flight -= 1
+        if error is not None:
+            self._failure(backend, error)
+
+    def _failure(self, backend: Backend, error: BaseException) -> None:
+        backend.failures += 1
+        backend.stats["errors"] += 1
+        backend.last_error = repr(error)
+        kind = "timeout" if isinstance(error, (httpx.TimeoutException, asyncio.TimeoutError)) else "error"
+        OLLAMA_ERRORS.inc(backend=backend.base, kind=kind)
+        log_event("ollama_error", logging.WARNING, backend=backend.base, kind=kind, error=repr(error))
+        if backend.failures >= self.failure_threshold or backend.trial:
+            backend.trial = False
+            backend.open_until = time.monotonic() + self.cooldown
+            backend.stats["trips"] += 1
+            OLLAMA_ERRORS.inc(backend=backend.base, kind="breaker_open")
+            log_event("breaker_open", logging.WARNING, backend=backend.base, failures=backend.failures,
+                      cooldown=self.cooldown)
+
+    async def _attempt(self, backend: Backend, fn: Callable[[str], Awaitable[T]]) -> T:
+        # L'annulation est traitée par `call` (_abort), même si la tâche n'a pas démarré.
+        t0 = time.monotonic()
+        try:
+            result = await fn(backend.base)
+        except Exception as e:
+            backend.in_flight -= 1
+            self._failure(backend, e)
+            raise
+        self._success(backend, time.monotonic() - t0)
+        return result
+
+    async def call(self, fn: Callable[[str], Awaitable[T]], model: Optional[str] = None,
+                   hedge: bool = True, discard: Optional[Callable[[T], Awaitable[Any]]] = None,
+                   prefer: Optional[str] = None) -> Tuple[Backend, T]:
+        """Exécute `fn(base)` sur la meilleure base et renvoie `(backend, résultat)`.
+
+        `fn` doit rendre la main dès le premier octet reçu. La base reste
+        comptée "en cours" jusqu'à `release(backend)`. Un échec bascule sur
+        une autre base ; `discard` libère un résultat arrivé trop tard.
+        """
+        tried: List[Backend] = []
+        tasks: Dict[asyncio.Task, Backend] = {}
+        trials: set[asyncio.Task] = set()
+        last_error: Optional[BaseException] = None
+
+        def launch() -> bool:
+            try:
+                b = self.pick(model, exclude=tried, prefer=None if tried else prefer)
+            except NoBackendAvailable:
+                return False
+            tried.append(b)
+            trial = self._acquire(b)
+            t = asyncio.create_task(self._attempt(b, fn))
+            tasks[t] = b
+            if trial:
+                trials.add(t)
+            return True
+
+        if not launch():
+            raise NoBackendAvailable("aucune base Ollama disponible")
+        hedged = not hedge
+        try:
+            while tasks:
+                timeout = None if hedged else self.hedge_delay
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Premier octet trop lent : on double la requête sur une autre base.
+                    hedged = True
+                    if launch():
+                        tried[0].stats["hedged"] += 1
+                    continue
+                winner = None
+                for t in done:
+                    b = tasks.pop(t)
+                    if t.exception() is not None:
+                        last_error = t.exception()
+                    elif winner is None:
+                        winner = (b, t.result())
+                    else:
+                        await self._drop(b, t.result(), discard)
+                if winner is not None:
+                    if len(tried) > 1 and winner[0] is not tried[0]:
+                        winner[0].stats["hedge_wins"] += 1
+                    return winner
+                if not tasks:
+                    # Échec franc : on réessaie ailleurs tant qu'il reste des bases.
+                    hedged = True
+                    launch()
+        finally:
+            for t, b in tasks.items():
+                t.cancel()
+            for t, b in tasks.items():
+                try:
+                    result = await t
+                except asyncio.CancelledError:
+                    self._abort(b, t in trials)
+                    continue
+                except BaseException:
+                    continue
+                await self._drop(b, result, discard)
+        raise last_error or NoBackendAvailable("aucune base Ollama disponible")
+
+    async def _drop(self, backend: Backend, result: Any, discard) -> None:
+        backend.in_flight -= 1
+        if discard is not None:
+            try:
+                await discard(result)
+            except Exception:
+                pass
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        return {
+            "probe_interval": self.probe_interval,
+            "failure_threshold": self.failure_threshold,
+            "cooldown": self.cooldown,
+            "hedge_delay": self.hedge_delay,
+            "backends": [b.snapshot(now) for b in self.backends.values()],
+        }
@@ -0,0 +1,29 @@
+import atexit, json, logging, os, queue, random, sys, time
+from logging.handlers import QueueHandler, QueueListener
+
+# Part des événements "info" par requête effectivement écrits (les erreurs le sont toujours).
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+
+_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_out = logging.StreamHandler(sys.stdout)
+_out.setFormatter(logging.Formatter("%(message)s"))
+# L'écriture sur stdout se fait dans le thread du listener, jamais dans la boucle asyncio.
+_listener = QueueListener(_queue, _out, respect_handler_level=False)
+_listener.start()
+atexit.register(_listener.stop)
+
+_logger = logging.getLogger("ferme")
+_logger.setLevel(logging.INFO)
+_logger.propagate = False
+_logger.addHandler(QueueHandler(_queue))
+
+def log_event(event: str, level: int = logging.INFO, sample: float | None = None, **fields) -> None:
+    """Écrit une ligne JSON `{"ts", "level", "event", …}` sans bloquer l'appelant.
+
+    Les événements INFO sont échantillonnés (`LOG_SAMPLE_RATE` par défaut) ;
+    WARNING et au-delà passent toujours.
+    """
+    if level < logging.WARNING and random.random() >= (LOG_SAMPLE_RATE if sample is None else sample):
+        return
+    line = {"ts": round(time.time(), 3), "level": logging.getLevelName(level).lower(), "event": event, **fields}
+    _logger.log(level, json.dumps(line, ensure_ascii=False, default=str))
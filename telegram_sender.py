@@ -0,0 +1,218 @@
+import asyncio, logging, os, time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Hashable, List, Optional
+import httpx
+from metrics import TELEGRAM_ERRORS, TELEGRAM_SEND_SECONDS
+from ratelimit import TokenBucket
+from slog import log_event
+
+TELEGRAM_API_BASE = (os.getenv("TELEGRAM_API_BASE") or "https://api.telegram.org").rstrip("/")
+TELEGRAM_MAX_LEN = 4096
+
+def split_at(text: str, limit: int = TELEGRAM_MAX_LEN) -> int:
+    """Index où couper `text` pour que le début tienne dans un message Telegram."""
+    if len(text) <= limit:
+        return len(text)
+    cut = max(text.rfind("\n", 0, limit), text.rfind(" ", 0, limit))
+    return cut if cut > limit // 2 else limit
+
+def split_text(text: str, limit: int = TELEGRAM_MAX_LEN) -> List[str]:
+    parts: List[str] = []
+    while len(text) > limit:
+        cut = split_at(text, limit)
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text or not parts:
+        parts.append(text)
+    return parts
+
+class _Pending:
+    __slots__ = ("method", "payload", "futures", "coalesce")
+
+    def __init__(self, method: str, payload: dict, future: asyncio.Future, coalesce: bool):
+        self.method = method
+        self.payload = payload
+        self.futures = [future]
+        self.coalesce = coalesce
+
+class TelegramSender:
+    """Envoi Telegram partagé : un seul client HTTP (connexions gardées ouvertes),
+    une file par chat, et des seaux à jetons global (~30 msg/s) et par chat (~1 msg/s).
+
+    Les messages d'un même chat partent dans l'ordre. Pendant qu'un chat attend
+    son jeton, les `sendMessage` qui s'accumulent derrière sont fusionnés en un
+    seul message (tant qu'il tient dans 4096 caractères). Une réponse 429 est
+    rejouée après le `retry_after` indiqué par Telegram.
+    """
+
+    def __init__(self, token: str, api_base: str = TELEGRAM_API_BASE, global_rate: float = 30.0,
+                 chat_rate: float = 1.0, chat_burst: int = 3, coalesce: bool = True,
+                 max_retries: int = 3, timeout: float = 15.0, max_connections: int = 20):
+        self.api = f"{api_base}/bot{token}" if token else ""
+        self.global_bucket = TokenBucket(global_rate, max(1, int(global_rate)))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.coalesce = coalesce
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._client: Optional[httpx.AsyncClient] = None
+        self._lanes: Dict[Hashable, Deque[_Pending]] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        self.stats = {"sent": 0, "coalesced": 0, "split": 0, "retried": 0, "throttled": 0, "failed": 0}
+
+    async def start(self) -> None:
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=limits,
+                transport=httpx.AsyncHTTPTransport(retries=1, limits=limits),
+            )
+
+    async def stop(self, drain: float = 5.0) -> None:
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=drain)
+        for t in list(self._tasks):
+            t.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self) -> "TelegramSender":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.stop()
+
+    # --- API publique ------------------------------------------------------
+
+    def submit(self, method: str, payload: dict, coalesce: bool = False) -> asyncio.Future:
+        """Met un appel en file pour le chat de `payload` ; la Future reçoit la réponse JSON."""
+        fut = asyncio.get_running_loop().create_future()
+        chat_id = payload.get("chat_id")
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            lane = self._lanes[chat_id] = deque()
+            t = asyncio.create_task(self._drain(chat_id, lane))
+            self._tasks.add(t)
+            t.add_done_callback(self._tasks.discard)
+        lane.append(_Pending(method, payload, fut, coalesce and self.coalesce))
+        return fut
+
+    async def call(self, method: str, payload: dict) -> dict:
+        return await self.submit(method, payload)
+
+    async def send_message(self, chat_id, text: str, coalesce: bool = True, **extra: Any) -> List[dict]:
+        """sendMessage découpé en morceaux de 4096 caractères, fusionnable avec ses
+        voisins sauf `coalesce=False` (avis système, qui partent toujours seuls)."""
+        parts = split_text(text)
+        if len(parts) > 1:
+            self.stats["split"] += len(parts) - 1
+        futs = [self.submit("sendMessage", {"chat_id": chat_id, "text": p, **extra}, coalesce=coalesce) for p in parts]
+        return list(await asyncio.gather(*futs))
+
+    # --- file par chat -----------------------------------------------------
+
+    def _bucket(self, chat_id: Hashable) -> TokenBucket:
+        b = self._buckets.get(chat_id)
+        if b is None:
+            b = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            while len(self._buckets) > 10000:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(chat_id)
+        return b
+
+    def _merge(self, item: _Pending, lane: Deque[_Pending]) -> None:
+        texts = [item.payload["text"]]
+        while item.coalesce and lane and lane[0].coalesce and lane[0].method == item.method:
+            nxt = lane[0]
+            same_opts = {k: v for k, v in nxt.payload.items() if k != "text"} == \
+                        {k: v for k, v in item.payload.items() if k != "text"}
+            if not same_opts:
+                break
+            # Un texte identique à un morceau déjà retenu n'est pas répété.
+            if nxt.payload["text"] not in texts:
+                text = f"{item.payload['text']}\n\n{nxt.payload['text']}"
+                if len(text) > TELEGRAM_MAX_LEN:
+                    break
+                texts.append(nxt.payload["text"])
+                item.payload = {**item.payload, "text": text}
+            lane.popleft()
+            item.futures += nxt.futures
+            self.stats["coalesced"] += 1
+
+    async def _drain(self, chat_id: Hashable, lane: Deque[_Pending]) -> None:
+        try:
+            while lane:
+                await self._bucket(chat_id).acquire()
+                await self.global_bucket.acquire()
+                item = lane.popleft()
+                self._merge(item, lane)
+                try:
+                    data = await self._post(item.method, item.payload)
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    log_event("telegram_error", logging.WARNING, method=item.method, chat_id=chat_id, error=repr(e))
+                    for f in item.futures:
+                        if not f.done():
+                            f.set_exception(e)
+                    continue
+                for f in item.futures:
+                    if not f.done():
+                        f.set_result(data)
+        finally:
+            self._lanes.pop(chat_id, None)
+            for item in lane:
+                for f in item.futures:
+                    if not f.done():
+                        f.cancel()
+
+    async def _post(self, method: str, payload: dict) -> dict:
+        if self._client is None or not self.api:
+            raise RuntimeError("TelegramSender non démarré ou token manquant")
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            t0 = time.perf_counter()
+            try:
+                r = await self._client.post(f"{self.api}/{method}", json=payload)
+            except httpx.TransportError as e:
+                TELEGRAM_ERRORS.inc(method=method, kind="timeout" if isinstance(e, httpx.TimeoutException) else "transport")
+                if last:
+                    raise
+                self.stats["retried"] += 1
+                await asyncio.sleep(min(2 ** attempt, 10))
+                continue
+            TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - t0, method=method)
+            try:
+                data = r.json()
+            except ValueError:
+                data = {"ok": False, "description": r.text[:200]}
+            if r.status_code != 200:
+                TELEGRAM_ERRORS.inc(method=method, kind=str(r.status_code))
+            if r.status_code == 429 and not last:
+                self.stats["throttled"] += 1
+                await asyncio.sleep(float((data.get("parameters") or {}).get("retry_after", 1)))
+                continue
+            if r.status_code >= 500 and not last:
+                self.stats["retried"] += 1
+                await asyncio.sleep(min(2 ** attempt, 10))
+                continue
+            if r.status_code == 200:
+                self.stats["sent"] += 1
+            else:
+                log_event("telegram_status", logging.WARNING, method=method, status=r.status_code,
+                          description=data.get("description"))
+            return data
+        return data
+
+    def snapshot(self) -> dict:
+        return {
+            "lanes": len(self._lanes),
+            "queued": sum(len(l) for l in self._lanes.values()),
+            "connected": self._client is not None,
+            **self.stats,
+        }
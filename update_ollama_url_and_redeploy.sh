@@ -28,6 +28,7 @@ echo "   OK: OLLAMA_BASE_URL mis à jour."
 
 # ----- 3) Déclencher un déploiement -----
 echo "[3/4] Déclenchement du déploiement Render…"
+DEPLOY_TS="$(date +%s)"
 curl -fsS -X POST \
   "https://api.render.com/v1/services/${RENDER_SERVICE_ID}/deploys" \
   -H "Authorization: Bearer ${RENDER_API_KEY}" \
@@ -35,19 +36,31 @@ curl -fsS -X POST \
   -d '{}' >/dev/null
 echo "   OK: Deploy déclenché."
 
-# ----- 4) Attendre que /health réponde 200 -----
-echo "[4/4] Attente de disponibilité ${RENDER_PUBLIC_URL%/}/health …"
+# ----- 4) Attendre que le modèle soit chargé (/health/ready = 200) -----
+# /health répond 200 dès que le port est ouvert ; /health/ready attend que
+# le modèle soit préchargé sur au moins une base Ollama. Tant que le nouveau
+# déploiement n'a pas démarré, c'est l'ancienne instance qui répond : on exige
+# donc une instance démarrée après le déclenchement et chaude sur NGROK_URL.
+echo "[4/4] Attente du modèle chaud ${RENDER_PUBLIC_URL%/}/health/ready …"
 ATTEMPTS=60
 SLEEP=5
+BODY_FILE="$(mktemp)"
+trap 'rm -f "${BODY_FILE}"' EXIT
 for i in $(seq 1 $ATTEMPTS); do
-  CODE="$(curl -s -o /dev/null -w '%{http_code}' "${RENDER_PUBLIC_URL%/}/health" || true)"
-  if [ "$CODE" = "200" ]; then
-    echo "   OK: Health 200 (${RENDER_PUBLIC_URL%/}/health)"
+  CODE="$(curl -s -o "${BODY_FILE}" -w '%{http_code}' "${RENDER_PUBLIC_URL%/}/health/ready" || true)"
+  STARTED="$(sed -n 's/.*"started_at": *\([0-9]*\).*/\1/p' "${BODY_FILE}" 2>/dev/null || true)"
+  if [ "$CODE" = "200" ] && [ "${STARTED:-0}" -ge "${DEPLOY_TS}" ] \
+     && grep -qF "\"${NGROK_URL}\"" "${BODY_FILE}"; then
+    echo "   OK: Ready 200, modèle chargé sur ${NGROK_URL} (${RENDER_PUBLIC_URL%/}/health/ready)"
     exit 0
   fi
-  echo "   … encore indisponible (code ${CODE}), retry ${i}/${ATTEMPTS}"
+  if [ "${STARTED:-0}" -lt "${DEPLOY_TS}" ]; then
+    echo "   … ancienne instance encore en ligne (code ${CODE}), retry ${i}/${ATTEMPTS}"
+  else
+    echo "   … pas encore prêt (code ${CODE}), retry ${i}/${ATTEMPTS}"
+  fi
   sleep $SLEEP
 done
 
-echo "TIMEOUT: /health ne répond pas 200. Va voir les logs Render."
+echo "TIMEOUT: /health/ready ne répond pas 200 (modèle non chargé ?). Va voir les logs Render."
 exit 4
@@ -1,17 +1,38 @@
 import os, re
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
 import httpx
 
 URL_RE = re.compile(r"^https://[a-z0-9-]+\.(ngrok-free\.app|trycloudflare\.com|loca\.lt)$", re.I)
 
-def get_ollama_base() -> str:
-    raw = (os.getenv("OLLAMA_BASE_URL") or "").strip().strip("'\"").rstrip("/")
+def check_base(raw: str) -> str:
+    raw = (raw or "").strip().strip("'\"").rstrip("/")
     if not raw or "/api" in raw:
         raise ValueError("OLLAMA_BASE_URL manquant ou invalide (ne pas inclure /api)")
     if any(k in raw for k in ("ngrok-free.app","trycloudflare.com","loca.lt")) and not URL_RE.match(raw):
         raise ValueError(f"OLLAMA_BASE_URL non valide: {raw}")
     return raw
 
-def http_client(timeout: float = 12.0) -> httpx.AsyncClient:
+def parse_bases(raw: str) -> list[str]:
+    """Liste de bases séparées par des virgules ou des espaces (doublons retirés)."""
+    bases: list[str] = []
+    for part in re.split(r"[,\s]+", (raw or "").strip().strip("'\"")):
+        if part:
+            base = check_base(part)
+            if base not in bases:
+                bases.append(base)
+    return bases
+
+def get_ollama_bases() -> list[str]:
+    bases = parse_bases(os.getenv("OLLAMA_BASE_URL") or "")
+    if not bases:
+        raise ValueError("OLLAMA_BASE_URL manquant ou invalide (ne pas inclure /api)")
+    return bases
+
+def get_ollama_base() -> str:
+    return get_ollama_bases()[0]
+
+def http_client(timeout: float | httpx.Timeout = 12.0) -> httpx.AsyncClient:
     transport = httpx.AsyncHTTPTransport(retries=1)
     return httpx.AsyncClient(
         http2=False,
@@ -23,3 +44,38 @@ def http_client(timeout: float = 12.0) -> httpx.AsyncClient:
             "Accept": "application/json",
         },
     )
+
+# Client partagé, ouvert une fois par le lifespan de l'app : les connexions
+# (et poignées de main TLS) vers les tunnels Ollama sont réutilisées.
+_shared: httpx.AsyncClient | None = None
+
+def open_shared_client(timeout: float | httpx.Timeout = 12.0) -> httpx.AsyncClient:
+    global _shared
+    if _shared is None:
+        _shared = http_client(timeout=timeout)
+    return _shared
+
+async def close_shared_client() -> None:
+    global _shared
+    if _shared is not None:
+        await _shared.aclose()
+        _shared = None
+
+@asynccontextmanager
+async def ollama_client(timeout: float | httpx.Timeout = 12.0) -> AsyncIterator[httpx.AsyncClient]:
+    """Le client partagé s'il est ouvert, sinon un client jetable (scripts, tests).
+
+    Avec le client partagé, passer `timeout=` à chaque requête.
+    """
+    if _shared is not None:
+        yield _shared
+    else:
+        async with http_client(timeout=timeout) as c:
+            yield c
+
+async def probe_tags(base: str, timeout: float = 12.0) -> tuple[httpx.Response, bytes]:
+    """GET {base}/api/tags : le test de vie utilisé par /diag et par le routeur."""
+    async with ollama_client(timeout) as c:
+        r = await c.get(f"{base}/api/tags", headers={"ngrok-skip-browser-warning": "true"}, timeout=timeout)
+        body = await r.aread()
+        return r, body